@@ -4,8 +4,8 @@
 Template IAS0060 home assignment 4 Project 1 (SCITOS).
 Node which handles odometry and laserdata, updates
 the occ_map class and publishes the OccupanyGrid message.
-And a map class that handles the probabilistic map up-
-dates.
+The map class that handles the probabilistic map up-
+dates lives in occupancy_map.py, free of ROS imports.
 
 @author: Christian Meurer
 @date: February 2022
@@ -16,181 +16,139 @@ Team members: Benoit Auclair; Michael Bryan
 Date: March 9, 2022
 """
 
+import functools
+import os
+import queue
+import threading
+import time
+
 import numpy as np
 import rospy
 from tf.transformations import euler_from_quaternion, quaternion_from_euler
 from geometry_msgs.msg import Pose
 from geometry_msgs.msg import Point
+from geometry_msgs.msg import PoseArray
 from nav_msgs.msg import Odometry
 from nav_msgs.msg import OccupancyGrid
 from nav_msgs.msg import MapMetaData
 from std_msgs.msg import Header
 from sensor_msgs.msg import LaserScan
-from coordinate_transformations import world_to_grid
-from bresenham import bresenham
-
-class OGMap:
+from map_msgs.msg import OccupancyGridUpdate
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from visualization_msgs.msg import Marker, MarkerArray
+# the map classes are also importable from here, as before the split
+from occupancy_map import DirtyRegion, OccupancyPyramid, OGMap, TiledOGMap
+from occupancy_map import footprint_radii
+from pose_buffer import PoseBuffer
+from scan_preprocessing import ScanPreprocessor
+from stage_timer import StageTimer
+from deskew import deskew_poses
+
+
+def period(rate):
     """
-    Map class which translates the laser ranges into grid cell
-    occupancies and updates the OccupancyGrid variable
-    @input: map metadata (height, width, resolution, origin)
-    @input: sensor model (reading probability, below reading probability, tau)
-    @input: laser ranges and laser metadata (min / max angles,
-            angle increments, min / max ranges)
-    @output: updated occupancy grid map as 2D np.array()
+    Returns the period of a rate parameter
+    @param: rate - frequency [Hz], 0 to disable
+    @result: returns the period [s], None if disabled
     """
-    def __init__(self, height, width, resolution, map_origin, tau, r_prob, below_r_prob):
-        """
-        class initialization
-        @param: self
-        @param: height - map size along y-axis [m]
-        @param: width - map size along x-axis [m]
-        @param: resolution - size of a grid cell [m]
-        @param: map_origin - origin in real world [m, m]
-        @param: reading probability
-        @param: below reading probability
-        @param: tau - depth of the reading point
-        @result: initializes occupancy grid variable and
-                 logg odds variable based on sensor model
-        """
-        ### get map metadata ###
-        self.height = height
-        self.width = width
-        self.resolution = resolution
-        self.map_origin = map_origin
-
-        ### static content of Occupancy Grid message
-        ### map metadata for msg ###
-        self.map_meta_data = MapMetaData()
-        self.map_meta_data.resolution = resolution # size of a cell
-        self.map_meta_data.width = int(width/resolution) # [cells]
-        self.map_meta_data.height = int(height/resolution) # [cells]
-        self.map_meta_data.origin = Pose()
-        self.map_meta_data.origin.position = Point()
-        self.map_meta_data.origin.position.x, self.map_meta_data.origin.position.y = map_origin
-
-        ### declaration of Occupancy Grid message
-        self.grid = OccupancyGrid()
-        self.grid.info = self.map_meta_data
-        self.grid.header = Header()
-        self.grid.header.frame_id = "map"
-        self.grid.data = None
-
-        ### define probabilities for Bayesian belief update ###
-        ### get sensor model ###
-        self.tau = tau
-        self.r_prob = r_prob
-        self.below_r_prob = below_r_prob
-
-        ### define logood variables ###
-        self.odds_r_prob = np.log(self.r_prob / (1 - self.r_prob))
-        self.odds_below_r_prob = np.log(self.below_r_prob / (1 - self.below_r_prob))
-
-        ### initialize occupancy and logodd grid variables ###
-        self.prob_map = -1 * np.ones([int(self.height / self.resolution), int(self.width / self.resolution)])
-        self.logodds_map = np.zeros([int(self.height / self.resolution), int(self.width / self.resolution)])
-
-
-    def updatemap(self,laser_scan,angle_min,angle_max,angle_increment,range_min,range_max,robot_pose, yaw):
-        """
-        Function that updates the occupancy grid based on the laser scan ranges.
-        The logodds formulation of the Bayesian belief update is used
-        @param: laser_scan - range data from the laser range finder
-        @param: angle_min, angle_max - boundaries of the circular arc of the laser ranges
-        @param: angle_increment - angular step between consecutive laser rays
-        @param: range_min, range_max - min and max distances at which the laser range finder can detect an obstacle
-        @param: robot_pose - the planar robot pose in world coordinates
-        @result: updates the list of occupancy cells based on occupancy probabilities ranging from [0,100]
-        """
-
-        ### transform robot pose into grid coordinates ###
-        robot_pos_grid = world_to_grid(robot_pose[0], robot_pose[1],
-                                        self.map_origin[0], self.map_origin[1], self.width, self.height, self.resolution)
-
-        ### for all rays in the laser scan do: ###
-        for idx_range, measured_range in enumerate(laser_scan):
-
-            # discard the measured range if outside of allowed range
-            if measured_range < range_min or measured_range > range_max:
-                continue
-
-            ### calculate coordinates of object the laser ray hit in
-            # compute yaw angle of laser beam
-            theta = yaw + angle_min + idx_range * angle_increment
-
-            # the line joining the robot to the object is resolved in two sections
-            # the first section are non-occupied cells
-            # the second section are occupied cells
-
-            # section 1
-            # calculate how far away from the robot the object is
-            # taking into account the uncertainty tau around the reading
-            delta_x = (measured_range - self.tau/2) * np.cos(theta)
-            delta_y = (measured_range - self.tau/2) * np.sin(theta)
-
-            # convert world coordinates of (target - tau) into grid coordinates
-            target_minus_tau = world_to_grid(robot_pose[0] + delta_x, robot_pose[1] + delta_y,
-                                                 self.map_origin[0], self.map_origin[1], self.width, self.height, self.resolution)
-
-            # section 2
-            # calculate how far away from the robot the object is
-            # taking into account the uncertainty tau around the reading
-            delta_x = (measured_range + self.tau/2) * np.cos(theta)
-            delta_y = (measured_range + self.tau/2) * np.sin(theta)
-
-            # convert world coordinates of (target + tau) into grid coordinates
-            target_plus_tau = world_to_grid(robot_pose[0] + delta_x, robot_pose[1] + delta_y,
-                                                 self.map_origin[0], self.map_origin[1], self.width, self.height, self.resolution)
-
-            ### define a line from laser ray point to robot pose
-            if target_minus_tau and target_plus_tau:
-
-                # resolve location of non-occupied cells in grid coordinates
-                non_occupied_cells = bresenham(robot_pos_grid[0], robot_pos_grid[1], target_minus_tau[0], target_minus_tau[1])
-                # get rid of the first cell in the list because it is also listed as an occupied cell
-                non_occupied_cells.pop(-1)
-
-                # resolve location of occupied cells in grid coordinates
-                occupied_cells = bresenham(target_minus_tau[0], target_minus_tau[1], target_plus_tau[0], target_plus_tau[1])
-
-                # process list of non-occupied cells
-                for cell in non_occupied_cells:
-                    x = cell[0]
-                    y = cell[1]
-                    self.cellUpdate(x, y, self.odds_below_r_prob)
-
-                # process list of occupied cells
-                for cell in occupied_cells:
-                    x = cell[0]
-                    y = cell[1]
-                    self.cellUpdate(x, y, self.odds_r_prob)
-
-    def cellUpdate(self, x, y, logodds_update):
-        """updates a specific cell in the occupancy grid following an observation
-            @param: x, y - indices of the cell in the occupancy grid
-            @param: logodds_update - likelihood of the observation in logodds representation
-            @result: updated occupancy grid maps (in logodds and probability representations)
-        """
-        # if the cell had not been observed so far we set the prior on it to 0.5
-        if self.prob_map[y][x] == -1:
-            self.prob_map[y][x] = 0.5
+    return 1.0 / rate if rate > 0 else None
 
-        # update the logodds representation
-        self.logodds_map[y][x] += logodds_update
 
-        # update the probability representation
-        self.prob_map[y][x] = 1 - 1 / (1 + np.exp(self.logodds_map[y][x]))
-
-    def returnMap(self):
-        """returns latest map as OccupancyGrid object
-        """
-        # scale the occupancy between 0 and 100 for every cell that's been seen at least one
-        scaled_prob = self.prob_map.copy()
-        scaled_prob[scaled_prob > 0] *= 100
-
-        # integrate the updated map to the occupancy message
-        self.grid.data = scaled_prob.flatten().astype(np.int8)
-        return self.grid
+def occupancy_grid(resolution, origin, occupancy, frame_id="map"):
+    """
+    Builds the message of a map
+    @param: resolution - size of a grid cell [m]
+    @param: origin - world coordinates [x, y] of the bottom left corner of the map
+    @param: occupancy - 2D int8 array of occupancies indexed [y, x]
+    @param: frame_id - frame of the map
+    @result: returns the nav_msgs OccupancyGrid message
+    """
+    grid = OccupancyGrid()
+    grid.header = Header()
+    grid.header.frame_id = frame_id
+    grid.info = MapMetaData()
+    grid.info.resolution = resolution # size of a cell
+    grid.info.width = occupancy.shape[1] # [cells]
+    grid.info.height = occupancy.shape[0] # [cells]
+    grid.info.origin = Pose()
+    grid.info.origin.position = Point()
+    grid.info.origin.position.x, grid.info.origin.position.y = origin
+    grid.data = occupancy.ravel()
+    return grid
+
+
+def occupancy_grid_update(x, y, occupancy, frame_id="map"):
+    """
+    Builds the message of a changed region of a map
+    @param: x, y - cell offsets of the region in the last published map
+    @param: occupancy - 2D int8 array of occupancies of the region indexed [y, x]
+    @param: frame_id - frame of the map
+    @result: returns the map_msgs OccupancyGridUpdate message
+    """
+    update = OccupancyGridUpdate()
+    update.header = Header()
+    update.header.frame_id = frame_id
+    update.x = x
+    update.y = y
+    update.width = occupancy.shape[1]
+    update.height = occupancy.shape[0]
+    update.data = occupancy.ravel()
+    return update
+
+
+def frontier_goals(frontiers, frame_id="map"):
+    """
+    Builds the message of the ranked exploration goals
+    @param: frontiers - ranked list of (centroid [x, y], goal [x, y], size [cells]) per frontier cluster
+    @param: frame_id - frame of the map
+    @result: returns the geometry_msgs PoseArray message of the goals, best first
+    """
+    goals = PoseArray()
+    goals.header = Header()
+    goals.header.frame_id = frame_id
+    goals.header.stamp = rospy.Time.now()
+    goals.poses = []
+    for _, goal, _ in frontiers:
+        pose = Pose()
+        pose.position = Point()
+        pose.position.x, pose.position.y = goal
+        pose.orientation.w = 1.0
+        goals.poses.append(pose)
+    return goals
+
+
+def frontier_markers(frontiers, resolution, frame_id="map"):
+    """
+    Builds the markers of the frontier clusters, a sphere at every centroid
+    whose diameter grows with the size of the cluster, the best ranked in red
+    @param: frontiers - ranked list of (centroid [x, y], goal [x, y], size [cells]) per frontier cluster
+    @param: resolution - size of a grid cell [m]
+    @param: frame_id - frame of the map
+    @result: returns the visualization_msgs MarkerArray message
+    """
+    markers = MarkerArray()
+    # the clusters of the previous message are removed first
+    clear = Marker()
+    clear.header = Header()
+    clear.header.frame_id = frame_id
+    clear.action = Marker.DELETEALL
+    markers.markers = [clear]
+    for rank, (centroid, _, size) in enumerate(frontiers):
+        marker = Marker()
+        marker.header = clear.header
+        marker.ns = "frontiers"
+        marker.id = rank
+        marker.type = Marker.SPHERE
+        marker.action = Marker.ADD
+        marker.pose = Pose()
+        marker.pose.position = Point()
+        marker.pose.position.x, marker.pose.position.y = centroid
+        marker.pose.orientation.w = 1.0
+        marker.scale.x = marker.scale.y = marker.scale.z = 2 * resolution * np.sqrt(size)
+        marker.color.r, marker.color.g, marker.color.b, marker.color.a = \
+            (1.0, 0.0, 0.0, 0.8) if rank == 0 else (0.0, 0.6, 1.0, 0.6)
+        markers.markers.append(marker)
+    return markers
 
 
 class OGMapping:
@@ -213,14 +171,70 @@ class OGMapping:
         """
         ### timing ###
         self.dt = dt
-        self.rate = rospy.Rate(20)
+        self.publish_rate = rospy.get_param("/mapping/publish_rate", 20.0) # [Hz]
+        if self.publish_rate <= 0:
+            raise ValueError(f"/mapping/publish_rate must be positive, got {self.publish_rate}")
+
+        ### the map is integrated and published by separate threads ###
+        # the publishing thread holds the lock only to copy the changed cells into its snapshot
+        self.map_lock = threading.Lock()
+        self.publish_thread = threading.Thread(target=self.publishLoop, daemon=True)
+
+        ### timings of the mapping stages ###
+        # rolling percentiles published on /mapping/stats, and optionally traced to a CSV file
+        self.stage_timer = StageTimer(rospy.get_param("/mapping/stats_window", 1000),
+                                      os.path.expanduser(rospy.get_param("/mapping/stats_csv", "")) or None)
+        self.stats_period = period(rospy.get_param("/mapping/stats_rate", 1.0)) # [s], None for no stats
+        self.last_stats_time = None
+        self.stats_pub = rospy.Publisher("/mapping/stats", DiagnosticArray, queue_size=1)
+        rospy.on_shutdown(self.stage_timer.close)
+
+        ### bounded queue of the laser scans waiting for integration ###
+        # when it is full the oldest scan is dropped, so that the callback never blocks
+        self.scan_queue = queue.Queue(maxsize=rospy.get_param("/mapping/scan_queue_size", 10))
+        self.scans_received = 0
+        self.scans_integrated = 0
+        self.scans_dropped = 0
+        self.scans_without_pose = 0
+
+        ### buffer of the latest stamped robot poses ###
+        # shared between the odometry callback and the mapping loop
+        self.pose_buffer = PoseBuffer(rospy.get_param("/mapping/pose_buffer_size", 200))
+        self.pose_buffer_lock = threading.Lock()
+        self.pose_tolerance = rospy.get_param("/mapping/pose_tolerance", 0.05) # [s]
+        # interpolate the pose of every laser ray over the scan period
+        self.deskew = rospy.get_param("/mapping/deskew", False)
 
         ### subscribers ###
         self.pose_sub = rospy.Subscriber("/ground_truth", Odometry, self.odometryCallback)
         self.laserScan_sub = rospy.Subscriber("/laser_scan", LaserScan, self.laserScanCallback)
         
         ### publishers ###
-        self.map_pub = rospy.Publisher("/map", OccupancyGrid, queue_size=1) # queue_size=1 => only the newest map available
+        # the full map goes out at a low rate and to every new subscriber,
+        # in between only the changed region is published
+        self.map_pub = rospy.Publisher("/map", OccupancyGrid, queue_size=1, # queue_size=1 => only the newest map available
+                                       subscriber_listener=MapSubscribeListener(self))
+        self.map_updates_pub = rospy.Publisher("/map_updates", OccupancyGridUpdate, queue_size=10)
+        # None for the full map only to new subscribers
+        self.full_map_period = period(rospy.get_param("/mapping/full_map_rate", 1.0)) # [s]
+        self.full_map_requested = True
+        self.last_full_map_time = None
+        # max-pooled coarser levels of the map, latched as they only change with the map
+        self.level_pubs = [rospy.Publisher(f"/map/level{level}", OccupancyGrid, queue_size=1, latch=True)
+                           for level in range(1, rospy.get_param("/map/pyramid_levels", 0) + 1)]
+        # inflated costmap, published alongside the map when an inflation radius is set
+        self.costmap_pub = None
+        if rospy.get_param("/robot_parameters/inflation_radius", 0.0) > 0:
+            self.costmap_pub = rospy.Publisher("/map/costmap", OccupancyGrid, queue_size=1, latch=True)
+            self.costmap_updates_pub = rospy.Publisher("/map/costmap_updates", OccupancyGridUpdate, queue_size=10)
+        # frontier clusters and the exploration goals ranked from the robot position
+        self.frontier_pubs = None
+        if rospy.get_param("/mapping/frontier_min_size", 0) > 0:
+            self.frontier_pubs = (rospy.Publisher("/map/frontiers", MarkerArray, queue_size=1, latch=True),
+                                  rospy.Publisher("/map/frontier_goals", PoseArray, queue_size=1, latch=True))
+        # None for a detection at every publishing cycle
+        self.frontier_period = period(rospy.get_param("/mapping/frontier_rate", 2.0)) # [s]
+        self.last_frontier_time = None
 
         ### get map parameters ###
         self.width = rospy.get_param("/map/width")
@@ -231,50 +245,267 @@ class OGMapping:
         ### fetch laser frame ###
         self.laserScaner_to_robotbase = rospy.get_param("/robot_parameters/laserscanner_pose")
 
+        ### robot footprint for the costmap ###
+        footprint = rospy.get_param("/robot_parameters/footprint", None)
+        self.inscribed_radius = footprint_radii(footprint)[0] if footprint else 0.0
+
         ### get sensor model ###
         self.tau = np.array(rospy.get_param("sensor_model/tau"))
         self.r_prob = np.array(rospy.get_param("sensor_model/r_prob"))
         self.below_r_prob = np.array(rospy.get_param("sensor_model/below_r_prob"))
 
         ### initialize occupancy grid map class ###
-        self.occ_grid_map = OGMap(self.height, self.width, self.resolution, self.map_origin,
-                                  self.tau, self.r_prob, self.below_r_prob)
+        # the map lives in memory-mapped files when checkpointing is enabled
+        checkpoint_file = rospy.get_param("/mapping/checkpoint_file", "")
+        # either a dense grid of fixed size or tiles allocated on demand
+        if rospy.get_param("/map/backend", "dense") == "tiled":
+            map_class = functools.partial(TiledOGMap, tile_size=rospy.get_param("/map/tile_size", 64))
+            if checkpoint_file:
+                rospy.logwarn("The tiled map cannot be checkpointed, it is kept in memory only")
+                checkpoint_file = ""
+        else:
+            map_class = OGMap
+        self.occ_grid_map = map_class(self.height, self.width, self.resolution, self.map_origin,
+                                  self.tau, self.r_prob, self.below_r_prob,
+                                  storage=rospy.get_param("sensor_model/storage", "float64"),
+                                  logodds_resolution=rospy.get_param("sensor_model/logodds_resolution", 0.05),
+                                  logodds_min=rospy.get_param("sensor_model/logodds_min", None),
+                                  logodds_max=rospy.get_param("sensor_model/logodds_max", None),
+                                  map_file=os.path.expanduser(checkpoint_file) if checkpoint_file else None,
+                                  # a respawned node resumes the map, a new roslaunch starts a new one
+                                  map_session=rospy.get_param("/run_id", None),
+                                  workers=rospy.get_param("/mapping/workers", 1),
+                                  scan_preprocessor=ScanPreprocessor(
+                                      decimation=rospy.get_param("/mapping/decimation", 1),
+                                      deduplicate=rospy.get_param("/mapping/deduplicate", False),
+                                      max_range_free=rospy.get_param("/mapping/max_range_free", True)),
+                                  ray_table_bins=rospy.get_param("/mapping/ray_table_bins", 0),
+                                  jit=rospy.get_param("/mapping/jit", True),
+                                  decay_half_life=rospy.get_param("sensor_model/decay_half_life", 0))
+        # the levels, the costmap and the frontiers are only maintained for the published snapshot
+        self.map_consumers = dict(pyramid_levels=rospy.get_param("/map/pyramid_levels", 0),
+                                  inscribed_radius=self.inscribed_radius,
+                                  inflation_radius=rospy.get_param("/robot_parameters/inflation_radius", 0.0),
+                                  cost_scaling_factor=rospy.get_param("/robot_parameters/cost_scaling_factor", 10.0),
+                                  frontier_min_size=rospy.get_param("/mapping/frontier_min_size", 0))
+        rospy.loginfo(f"Ray casting engine: {self.occ_grid_map.engine}")
+        if self.occ_grid_map.resumed:
+            rospy.loginfo(f"Resumed the map from {checkpoint_file}")
+
+        ### maps exchanged with map_server ###
+        # a previous map the mapping starts from, unless the checkpoint has been resumed
+        seed_map = rospy.get_param("/mapping/seed_map", "")
+        if seed_map and not self.occ_grid_map.resumed:
+            self.occ_grid_map.seedMap(os.path.expanduser(seed_map))
+            rospy.loginfo(f"Seeded the map from {seed_map}")
+        # map written when the node shuts down
+        self.save_map_file = rospy.get_param("/mapping/save_map", "")
+        if self.save_map_file:
+            rospy.on_shutdown(self.saveMap)
+
+        ### periodic checkpoint of the memory-mapped map ###
+        # the map files are flushed from the timer thread, the mapping loop keeps running
+        if checkpoint_file:
+            self.checkpoint_timer = rospy.Timer(rospy.Duration(rospy.get_param("/mapping/checkpoint_period", 10.0)),
+                                                self.checkpointCallback)
 
         ### initialization of class variables ###
         self.robot_pose = None
-        self.laserscanner_pose = None
-        self.scan_msg = None
         self.odom_msg = None
 
     def run(self):
         """
-        Main loop of class.
+        Main loop of class, integrates the queued laser scans as they
+        arrive while the map is published by the publishing thread
         @param: self
-        @result: runs the step function for map update
+        @result: runs the step function for every laser scan and
+                 closes the map on shutdown
         """
-        while not rospy.is_shutdown():
-            ### step only when odometry and laser data are available ###
-            if self.scan_msg and self.odom_msg:
-                self.step()
-            self.rate.sleep()
-
-    def step(self):
+        self.publish_thread.start()
+        try:
+            while not rospy.is_shutdown():
+                try:
+                    # wakes up regularly to notice the shutdown
+                    scan_msg = self.scan_queue.get(timeout=1.0)
+                except queue.Empty:
+                    continue
+                self.step(scan_msg)
+        finally:
+            # closed by the mapping loop itself, so that the ray tracing
+            # processes are never stopped in the middle of a scan
+            self.occ_grid_map.close()
+
+    def step(self, scan_msg):
         """
         Perform an iteration of the mapping loop
         @param: self
-        @result: updates the map information and publishes new map data
+        @param: scan_msg - next LaserScan message of the queue
+        @result: updates the map information
         """
-        ### step only when odometry and laser data are available ###
-        if self.scan_msg and self.odom_msg:
-            # publish current occupancy map
-            self.map_pub.publish(self.occ_grid_map.returnMap())
+        if scan_msg is not None:
+            # robot pose at the time the scan was taken
+            stamp = scan_msg.header.stamp.to_sec()
+            with self.stage_timer.measure("pose_lookup"), self.pose_buffer_lock:
+                pose = self.pose_buffer.lookup(stamp, self.pose_tolerance)
+                # and the pose of the laser scanner for every ray if the scan is deskewed
+                ray_poses = None
+                if self.deskew and scan_msg.time_increment > 0 and pose is not None:
+                    ray_poses = deskew_poses(self.pose_buffer, stamp, len(scan_msg.ranges),
+                                             scan_msg.time_increment, self.laserScaner_to_robotbase[0],
+                                             self.pose_tolerance)
 
             # update map only if odometry data available
-            if self.robot_pose:
-                self.occ_grid_map.updatemap(self.scan_msg.ranges, self.scan_msg.angle_min,
-                                            self.scan_msg.angle_max, self.scan_msg.angle_increment,
-                                            self.scan_msg.range_min, self.scan_msg.range_max,
-                                            self.laserscanner_pose, self.robot_yaw)
+            if pose is not None:
+                if ray_poses is not None:
+                    laser_pose, laser_yaw = ray_poses[:2], ray_poses[2]
+                else:
+                    laser_pose, laser_yaw = self.laserScannerPose(pose[0], pose[1], pose[2]), pose[2]
+                with self.map_lock, self.stage_timer.measure("updatemap"):
+                    self.occ_grid_map.updatemap(scan_msg.ranges, scan_msg.angle_min,
+                                                scan_msg.angle_max, scan_msg.angle_increment,
+                                                scan_msg.range_min, scan_msg.range_max,
+                                                laser_pose, laser_yaw, stamp)
+                self.scans_integrated += 1
+                self.stage_timer.record("cells", self.occ_grid_map.last_update_cells, unit="cells")
+                # from the scan stamp until the scan is in the map
+                self.stage_timer.record("scan_to_map_latency", rospy.get_time() - stamp)
+            else:
+                self.scans_without_pose += 1
+
+    def publishLoop(self):
+        """
+        Loop of the publishing thread, copies the map into a snapshot between
+        two scans and publishes it at the publishing rate, so that the
+        integration never waits for the messages to be built and serialized
+        @param: self
+        @result: publishes the map as long as the node runs
+        """
+        # the rate restarts when the clock jumps back, e.g. after a simulation reset
+        rate = rospy.Rate(self.publish_rate, reset=True)
+        snapshot = None
+        while not rospy.is_shutdown():
+            cycle_start = time.perf_counter()
+            ### publish only when odometry and laser data are available ###
+            if self.scans_received and self.odom_msg:
+                with self.stage_timer.measure("snapshot"), self.map_lock:
+                    first_snapshot = snapshot is None
+                    snapshot = self.occ_grid_map.snapshot(snapshot)
+                if first_snapshot:
+                    snapshot.buildConsumers(**self.map_consumers)
+                # publish current occupancy map
+                self.publishMap(snapshot)
+                rospy.loginfo_throttle(10, f"Laser scans received: {self.scans_received}, "
+                                           f"integrated: {self.scans_integrated}, "
+                                           f"dropped: {self.scans_dropped}, "
+                                           f"without pose: {self.scans_without_pose}, "
+                                           f"{self.occ_grid_map.scan_preprocessor.summary()}")
+
+            # time the publishing cycle runs over its period
+            self.stage_timer.record("publish_overrun",
+                                    max(time.perf_counter() - cycle_start - 1.0 / self.publish_rate, 0.0))
+            now = rospy.get_time()
+            if self.stats_period is not None and (self.last_stats_time is None
+                                                  or not 0 <= now - self.last_stats_time < self.stats_period):
+                self.last_stats_time = now
+                self.publishStats()
+            try:
+                rate.sleep()
+            except rospy.ROSInterruptException:
+                break
+
+    def publishMap(self, occ_grid_map):
+        """
+        Publishes the full map if it is due or has been requested by a new
+        subscriber, otherwise only the region changed since the last publication
+        @param: self
+        @param: occ_grid_map - snapshot of the map to publish
+        @result: publishes OccupancyGrid or OccupancyGridUpdate message, the same
+                 for the costmap, the levels of the occupancy pyramid with the
+                 full map and the frontiers at their own rate
+        """
+        # the periods also elapse when the clock jumps back
+        now = rospy.get_time()
+        if (self.full_map_requested or occ_grid_map.needsFullMap()
+                or self.full_map_period is not None
+                and not 0 <= now - self.last_full_map_time < self.full_map_period):
+            self.full_map_requested = False
+            self.last_full_map_time = now
+            with self.stage_timer.measure("takeMap"):
+                grid = occupancy_grid(occ_grid_map.resolution, *occ_grid_map.takeMap())
+            with self.stage_timer.measure("publish_map"):
+                self.map_pub.publish(grid)
+            if self.costmap_pub is not None:
+                with self.stage_timer.measure("takeCostmap"):
+                    costmap = occupancy_grid(occ_grid_map.resolution, *occ_grid_map.takeCostmap())
+                self.costmap_pub.publish(costmap)
+            # coarser levels of the map along with the full map, if the map has changed since
+            levels = occ_grid_map.takePyramid()
+            if levels is not None:
+                for level_pub, level in zip(self.level_pubs, levels):
+                    level_pub.publish(occupancy_grid(*level))
+        else:
+            with self.stage_timer.measure("takeMapUpdate"):
+                map_update = occ_grid_map.takeMapUpdate()
+            if map_update is not None:
+                map_update = occupancy_grid_update(*map_update)
+                with self.stage_timer.measure("publish_map_update"):
+                    self.map_updates_pub.publish(map_update)
+            if self.costmap_pub is not None:
+                # the distances are only recomputed around the changed obstacles
+                with self.stage_timer.measure("takeCostmapUpdate"):
+                    costmap_update = occ_grid_map.takeCostmapUpdate()
+                if costmap_update is not None:
+                    self.costmap_updates_pub.publish(occupancy_grid_update(*costmap_update))
+
+        # frontiers of the cells changed since their last detection
+        if self.frontier_pubs is not None and (self.last_frontier_time is None or self.frontier_period is None
+                                               or not 0 <= now - self.last_frontier_time < self.frontier_period):
+            self.last_frontier_time = now
+            with self.stage_timer.measure("takeFrontiers"):
+                frontiers = occ_grid_map.takeFrontiers(self.robot_pose)
+            if frontiers is not None:
+                self.frontier_pubs[0].publish(frontier_markers(frontiers, occ_grid_map.resolution))
+                self.frontier_pubs[1].publish(frontier_goals(frontiers))
+
+    def checkpointCallback(self, event):
+        """
+        Writes the memory-mapped map to its files
+        @param: event - rospy.TimerEvent of the checkpoint timer
+        @result: the map can be resumed after a restart of the node
+        """
+        self.occ_grid_map.flush()
+
+    def publishStats(self):
+        """
+        Publishes the rolling percentiles of the stage timings and the scan counters
+        @param: self
+        @result: publishes DiagnosticArray message on /mapping/stats
+        """
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = "OGMapping: stages"
+        status.hardware_id = "mapping"
+        status.message = f"{self.scans_integrated} scans integrated"
+        status.values = [KeyValue(key=key, value=str(value)) for key, value in (
+            ("scans received", self.scans_received), ("scans integrated", self.scans_integrated),
+            ("scans dropped", self.scans_dropped), ("scans without pose", self.scans_without_pose))]
+        status.values += [KeyValue(key=key, value=value) for key, value in self.stage_timer.report()]
+
+        stats = DiagnosticArray()
+        stats.header = Header()
+        stats.header.stamp = rospy.Time.now()
+        stats.status = [status]
+        self.stats_pub.publish(stats)
+
+    def saveMap(self):
+        """
+        Saves the map for map_server, together with its logodds
+        @param: self
+        @result: written map files
+        """
+        with self.map_lock:
+            self.occ_grid_map.saveMap(os.path.expanduser(self.save_map_file), save_logodds=True)
+        rospy.loginfo(f"Map saved to {self.save_map_file}")
 
     def odometryCallback(self, data):
         """
@@ -294,18 +525,65 @@ class OGMapping:
         # extract robot pose
         self.robot_pose = [data.pose.pose.position.x, data.pose.pose.position.y]
 
-        # shift the robot pose to the laser frame
-        self.laserscanner_pose = [self.robot_pose[0] + np.cos(self.robot_yaw)*self.laserScaner_to_robotbase[0],
-                                  self.robot_pose[1] + np.sin(self.robot_yaw)*self.laserScaner_to_robotbase[0]]
+        # store the stamped pose for the lookup at the laser scan stamps
+        stamp = data.header.stamp.to_sec()
+        with self.pose_buffer_lock:
+            if not self.pose_buffer.add(stamp, self.robot_pose[0], self.robot_pose[1], self.robot_yaw) \
+                    and stamp < self.pose_buffer.newest():
+                # the clock jumped back, e.g. after a simulation reset
+                self.pose_buffer.clear()
+                self.pose_buffer.add(stamp, self.robot_pose[0], self.robot_pose[1], self.robot_yaw)
+
+    def laserScannerPose(self, x, y, yaw):
+        """
+        Shifts a robot pose to the laser frame
+        @param: x, y, yaw - planar robot pose in world coordinates
+        @result: returns the position [x, y] of the laser scanner
+        """
+        return [x + np.cos(yaw)*self.laserScaner_to_robotbase[0],
+                y + np.sin(yaw)*self.laserScaner_to_robotbase[0]]
 
     def laserScanCallback(self, data):
         """
-        Handles incoming Laserscan messages and updates the map
+        Handles incoming Laserscan messages
         @param: information from the laser scanner stored in the
                 LaserScan message
-        @result: internal update of the map using the occ_grid_map class
+        @result: queues the scan for integration into the map, dropping
+                 the oldest queued scan if the queue is full
+        """
+        self.scans_received += 1
+        try:
+            self.scan_queue.put_nowait(data)
+        except queue.Full:
+            try:
+                self.scan_queue.get_nowait()
+                self.scans_dropped += 1
+            except queue.Empty:
+                pass
+            self.scan_queue.put_nowait(data)
+
+
+class MapSubscribeListener(rospy.SubscribeListener):
+    """
+    Requests the publication of the full map whenever a new
+    subscriber connects to the map topic
+    """
+    def __init__(self, mapping):
         """
-        self.scan_msg = data
+        class initialization
+        @param: self
+        @param: mapping - OGMapping node publishing the map
+        """
+        super().__init__()
+        self.mapping = mapping
+
+    def peer_subscribe(self, topic_name, topic_publish, peer_publish):
+        """
+        Called by rospy when a subscriber connects
+        @result: the next mapping step publishes the full map
+        """
+        self.mapping.full_map_requested = True
+
 
 if __name__ == '__main__':
     # initialize node and name it
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite of the mapping hot paths, which needs no running ROS.
+Synthetic 720-ray scans are cast through a known world (a room with a few
+boxes sized after data/config/map.yaml, the laser scanner parameters are
+read from data/urdf/sensors/lidar.urdf.xacro) and the following is timed
+at several grid resolutions:
+ - OGMap.updatemap: scans per second and cost per cell update, also with
+   the compiled ray casting kernel if numba is installed
+ - bresenham_batch and the reference bresenham over the rays of one scan
+ - takeMap and takeMapUpdate: cost of preparing the map for publication
+The results are written as JSON, in the layout of pytest-benchmark, so
+that runs of different commits can be compared with --compare.
+
+usage: benchmark_mapping.py -o results.json
+       benchmark_mapping.py -o new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import yaml
+
+from occupancy_map import OGMap
+from bresenham import bresenham, bresenham_batch
+from coordinate_transformations import world_to_grid_batch
+from ray_tracing import compiled_ray_kernel, ParallelRayTracer
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONFIG_DIR = os.path.join(PACKAGE_DIR, "data", "config")
+LIDAR_XACRO = os.path.join(PACKAGE_DIR, "data", "urdf", "sensors", "lidar.urdf.xacro")
+
+RESOLUTIONS = [0.1, 0.05, 0.025] # [m/cell]
+
+
+def load_lidar_parameters(path=LIDAR_XACRO):
+    """
+    reads the scan geometry of the simulated laser scanner
+    @result: returns a dictionary of LaserScan metadata
+    """
+    sensor = next(element for element in ET.parse(path).iter("sensor") if element.get("type") == "ray")
+    samples = int(sensor.find("ray/scan/horizontal/samples").text)
+    angle_min = float(sensor.find("ray/scan/horizontal/min_angle").text)
+    angle_max = float(sensor.find("ray/scan/horizontal/max_angle").text)
+    return {"samples": samples,
+            "angle_min": angle_min,
+            "angle_max": angle_max,
+            "angle_increment": (angle_max - angle_min) / (samples - 1),
+            "range_min": float(sensor.find("ray/range/min").text),
+            "range_max": float(sensor.find("ray/range/max").text),
+            "update_rate": float(sensor.find("update_rate").text)}
+
+
+def cross(a, b):
+    """
+    z-component of the cross product of arrays of 2D vectors
+    """
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+class SyntheticWorld:
+    """
+    Rectangular room with boxes, made of line segments, in which
+    laser scans are cast analytically
+    """
+    def __init__(self, map_params):
+        """
+        class initialization
+        @param: map_params - map metadata (width, height, origin) as in map.yaml
+        @result: walls one meter inside of the map borders and four boxes
+        """
+        x0, y0 = map_params["origin"]
+        x1, y1 = x0 + map_params["width"], y0 + map_params["height"]
+        self.center = np.array([(x0 + x1) / 2, (y0 + y1) / 2])
+
+        corners = []
+        corners.append([(x0 + 1, y0 + 1), (x1 - 1, y0 + 1), (x1 - 1, y1 - 1), (x0 + 1, y1 - 1)])
+        for dx, dy in [(-6, -6), (6, -6), (6, 6), (-6, 6)]:
+            cx, cy = self.center + (dx, dy)
+            corners.append([(cx - 1, cy - 1), (cx + 1, cy - 1), (cx + 1, cy + 1), (cx - 1, cy + 1)])
+
+        starts, ends = [], []
+        for polygon in corners:
+            for k in range(len(polygon)):
+                starts.append(polygon[k])
+                ends.append(polygon[(k + 1) % len(polygon)])
+        self.starts = np.array(starts)
+        self.edges = np.array(ends) - self.starts
+
+    def cast(self, x, y, yaw, lidar, noise=0.01, rng=None):
+        """
+        casts a laser scan from the given pose
+        @param: x, y, yaw - pose of the laser scanner
+        @param: lidar - scan geometry from load_lidar_parameters()
+        @param: noise - standard deviation of the range noise [m]
+        @result: returns the array of ranges, inf where nothing is hit within range_max
+        """
+        theta = yaw + lidar["angle_min"] + np.arange(lidar["samples"]) * lidar["angle_increment"]
+        directions = np.stack([np.cos(theta), np.sin(theta)], axis=1)
+
+        # intersection of every ray with every segment
+        offsets = self.starts - (x, y)
+        denominator = cross(directions[:, None, :], self.edges[None, :, :])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = cross(offsets[None, :, :], self.edges[None, :, :]) / denominator
+            u = cross(offsets[None, :, :], directions[:, None, :]) / denominator
+        hit = (denominator != 0) & (t > 0) & (u >= 0) & (u <= 1)
+        ranges = np.where(hit, t, np.inf).min(axis=1)
+
+        if rng is not None and noise > 0:
+            ranges = ranges + rng.normal(0, noise, ranges.shape)
+        ranges[ranges > lidar["range_max"]] = np.inf
+        return ranges
+
+    def trajectory(self, n_poses, radius=4.0):
+        """
+        returns n_poses poses (x, y, yaw) on a circle around the room center
+        """
+        phi = np.linspace(0, 2 * np.pi, n_poses, endpoint=False)
+        return [(self.center[0] + radius * np.cos(p), self.center[1] + radius * np.sin(p), p + np.pi / 2)
+                for p in phi]
+
+
+def measure(function, rounds, warmup=1):
+    """
+    times repeated calls of a function
+    @result: returns a dictionary of statistics over the rounds [s]
+    """
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def summarize(times):
+    """
+    returns a dictionary of statistics over a list of timings [s]
+    """
+    rounds = len(times)
+    mean = statistics.mean(times)
+    return {"min": min(times), "max": max(times), "mean": mean, "median": statistics.median(times),
+            "stddev": statistics.stdev(times) if rounds > 1 else 0.0, "rounds": rounds,
+            "ops": 1 / mean if mean > 0 else float("inf")}
+
+
+def make_map(map_params, sensor_model, resolution, storage, jit=False):
+    """
+    creates an empty map of the configured size
+    @param: map_params - parameters of map.yaml
+    @param: sensor_model - parameters of sensor_model.yaml
+    @param: resolution - grid resolution [m/cell]
+    @param: storage - logodds storage type
+    @param: jit - trace the rays with the compiled kernel
+    @result: returns the OGMap
+    """
+    return OGMap(map_params["height"], map_params["width"], resolution, map_params["origin"],
+                 sensor_model["tau"], sensor_model["r_prob"], sensor_model["below_r_prob"],
+                 storage=storage, jit=jit,
+                 logodds_resolution=sensor_model.get("logodds_resolution", 0.05),
+                 logodds_min=sensor_model.get("logodds_min"),
+                 logodds_max=sensor_model.get("logodds_max"))
+
+
+def run_benchmarks(n_scans, rounds, resolutions, storages=("float64",), reference=True, workers=()):
+    """
+    runs the benchmark suite
+    @param: n_scans - number of synthetic scans integrated per updatemap round
+    @param: rounds - number of timed rounds of the other benchmarks
+    @param: resolutions - grid resolutions to benchmark [m/cell]
+    @param: storages - logodds storage types to benchmark
+    @param: reference - also time the reference bresenham implementation
+    @param: workers - numbers of ray tracing processes (> 1) to also time updatemap with
+    @result: returns the list of benchmark results
+    """
+    with open(os.path.join(CONFIG_DIR, "map.yaml")) as config_file:
+        map_params = yaml.safe_load(config_file)
+    with open(os.path.join(CONFIG_DIR, "sensor_model.yaml")) as config_file:
+        sensor_model = yaml.safe_load(config_file)
+    lidar = load_lidar_parameters()
+
+    rng = np.random.default_rng(0)
+    world = SyntheticWorld(map_params)
+    poses = world.trajectory(n_scans)
+    scans = [world.cast(x, y, yaw, lidar, rng=rng) for x, y, yaw in poses]
+    scan_args = (lidar["angle_min"], lidar["angle_max"], lidar["angle_increment"],
+                 lidar["range_min"], lidar["range_max"])
+
+    results = []
+
+    def add(name, group, params, stats, **extra_info):
+        """
+        appends a benchmark result
+        """
+        results.append({"name": name, "group": group, "params": params, "stats": stats,
+                        "extra_info": extra_info})
+
+    for resolution, storage in [(resolution, storage) for resolution in resolutions for storage in storages]:
+        params = {"resolution": resolution, "storage": storage}
+
+        ### map update: every scan of the trajectory is timed, on a fresh map per round ###
+        times = []
+        cells = []
+
+        def integrate(occ_grid_map):
+            """
+            integrates every scan of the trajectory, timing each one
+            """
+            for (x, y, yaw), ranges in zip(poses, scans):
+                start = time.perf_counter()
+                occ_grid_map.updatemap(ranges, *scan_args, [x, y], yaw)
+                times.append(time.perf_counter() - start)
+                cells.append(occ_grid_map.last_update_cells)
+            return occ_grid_map
+
+        def add_updatemap(params, make_round):
+            """
+            times updatemap on the fresh maps returned by make_round
+            """
+            del times[:], cells[:]
+            integrate(make_round())
+            del times[:], cells[:]
+            for _ in range(max(rounds // 10, 1)):
+                integrate(make_round())
+            stats = summarize(times)
+            cells_per_scan = statistics.mean(cells)
+            scans_per_second = stats["ops"]
+            add("updatemap", "updatemap", params, stats,
+                scans_per_second=scans_per_second,
+                cells_per_scan=cells_per_scan,
+                ns_per_cell=1e9 / (scans_per_second * cells_per_scan),
+                realtime_factor=scans_per_second / lidar["update_rate"])
+
+        add_updatemap(params, lambda: make_map(map_params, sensor_model, resolution, storage))
+
+        # parallel ray tracing, the worker processes are shared by the fresh maps of all rounds
+        for n_workers in [n for n in workers if n > 1]:
+            ray_tracer = ParallelRayTracer(n_workers)
+
+            def make_parallel_map():
+                """
+                returns a fresh map tracing its rays in the shared worker processes
+                """
+                occ_grid_map = make_map(map_params, sensor_model, resolution, storage)
+                occ_grid_map.ray_tracer = ray_tracer
+                return occ_grid_map
+
+            add_updatemap(dict(params, workers=n_workers), make_parallel_map)
+            ray_tracer.close()
+
+        # compiled ray casting kernel, if numba is installed
+        if storage == "float64" and compiled_ray_kernel() is not None:
+            add_updatemap(dict(params, engine="numba"),
+                          lambda: make_map(map_params, sensor_model, resolution, storage, jit=True))
+
+        ### ray traversal of one scan ###
+        occ_grid_map = integrate(make_map(map_params, sensor_model, resolution, storage))
+        x, y, yaw = poses[0]
+        grid = (map_params["origin"][0], map_params["origin"][1], map_params["width"], map_params["height"],
+                resolution)
+        theta = yaw + lidar["angle_min"] + np.arange(lidar["samples"]) * lidar["angle_increment"]
+        ranges = np.where(np.isfinite(scans[0]), scans[0], lidar["range_max"])
+        x1, y1, valid = world_to_grid_batch(x + ranges * np.cos(theta), y + ranges * np.sin(theta), *grid)
+        x0, y0, _ = world_to_grid_batch(x, y, *grid)
+        x1, y1 = x1[valid], y1[valid]
+        n_cells = bresenham_batch(x0, y0, x1, y1)[2][-1]
+
+        stats = measure(lambda: bresenham_batch(x0, y0, x1, y1), rounds)
+        add("bresenham_batch", "bresenham", params, stats,
+            rays=int(x1.size), cells=int(n_cells), ns_per_cell=1e9 * stats["mean"] / n_cells)
+        if reference:
+            rays = list(zip([int(x0)] * x1.size, [int(y0)] * x1.size, x1.tolist(), y1.tolist()))
+            stats = measure(lambda: [bresenham(*ray) for ray in rays], max(rounds // 10, 1))
+            add("bresenham", "bresenham", params, stats,
+                rays=int(x1.size), cells=int(n_cells), ns_per_cell=1e9 * stats["mean"] / n_cells)
+
+        ### map publishing ###
+        stats = measure(occ_grid_map.takeMap, rounds)
+        add("takeMap", "publish", params, stats, cells=int(occ_grid_map.logodds_map.size),
+            map_bytes=int(occ_grid_map.logodds_map.nbytes + occ_grid_map.observed.nbytes))
+
+        def publish_update():
+            """
+            integrates a scan and takes the changed region for publication
+            """
+            occ_grid_map.updatemap(scans[0], *scan_args, [x, y], yaw)
+            occ_grid_map.takeMapUpdate()
+
+        stats = measure(publish_update, rounds)
+        add("updatemap+takeMapUpdate", "publish", params, stats)
+
+    return results
+
+
+def machine_info():
+    """
+    describes the machine and the code the benchmarks ran on
+    @result: returns a dictionary of versions, platform and git commit
+    """
+    info = {"python": platform.python_version(), "numpy": np.__version__,
+            "machine": platform.machine(), "processor": platform.processor(), "system": platform.system()}
+    try:
+        info["commit"] = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=PACKAGE_DIR,
+                                        capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return info
+
+
+def benchmark_key(benchmark):
+    """
+    identifies a benchmark across runs
+    @param: benchmark - benchmark result
+    @result: returns the tuple of its name and its parameters as JSON
+    """
+    return benchmark["name"], json.dumps(benchmark["params"], sort_keys=True)
+
+
+def compare(results, baseline, threshold):
+    """
+    prints the change of the median times against a baseline run
+    @result: returns the list of benchmarks slower than the baseline by more than threshold
+    """
+    baseline = {benchmark_key(benchmark): benchmark for benchmark in baseline["benchmarks"]}
+    regressions = []
+    print(f"{'benchmark':<40} {'baseline [ms]':>14} {'current [ms]':>14} {'change':>8}")
+    for benchmark in results["benchmarks"]:
+        old = baseline.get(benchmark_key(benchmark))
+        if old is None:
+            continue
+        change = benchmark["stats"]["median"] / old["stats"]["median"] - 1
+        label = f"{benchmark['name']}[{'-'.join(str(value) for value in benchmark['params'].values())}]"
+        print(f"{label:<40} {1e3 * old['stats']['median']:>14.3f} "
+              f"{1e3 * benchmark['stats']['median']:>14.3f} {change:>+8.1%}")
+        if change > threshold:
+            regressions.append(label)
+    return regressions
+
+
+def main():
+    """
+    runs the benchmarks given on the command line, writes and compares their results
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the mapping hot paths on synthetic scans.")
+    parser.add_argument("-o", "--output", help="JSON file to write the results to")
+    parser.add_argument("--scans", type=int, default=40, help="synthetic scans integrated per round")
+    parser.add_argument("--rounds", type=int, default=50, help="timed rounds per benchmark")
+    parser.add_argument("--resolutions", type=float, nargs="+", default=RESOLUTIONS,
+                        help="grid resolutions to benchmark [m/cell]")
+    parser.add_argument("--storages", nargs="+", default=["float64"],
+                        help="logodds storage types to benchmark (float64, int16, int8)")
+    parser.add_argument("--no-reference", action="store_true",
+                        help="skip the slow reference bresenham implementation")
+    parser.add_argument("--workers", type=int, nargs="+", default=[],
+                        help="numbers of ray tracing processes to also benchmark updatemap with")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative slowdown of the median reported as regression")
+    args = parser.parse_args()
+
+    results = {"machine_info": machine_info(),
+               "datetime": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "benchmarks": run_benchmarks(args.scans, args.rounds, args.resolutions, args.storages,
+                                            not args.no_reference, args.workers)}
+
+    for benchmark in results["benchmarks"]:
+        extra = ", ".join(f"{key}={value:.4g}" for key, value in benchmark["extra_info"].items())
+        params = " ".join(f"{key}={value}" for key, value in benchmark["params"].items())
+        print(f"{benchmark['name']:<28} {params:<32} "
+              f"median={1e3 * benchmark['stats']['median']:9.3f} ms  {extra}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
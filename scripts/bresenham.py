@@ -4,11 +4,14 @@
 @author: Christian Meurer
 Week 4 assignment of the 2019 IAS0060 Robotics course
 helper function which returns a list of coordinates of a line between two 
-given integer coordinates, based on the Bresenham algorithm
+given integer coordinates, based on the Bresenham algorithm, and its batch
+version tracing many lines at once into NumPy index arrays
 """
 
 import math
 
+import numpy as np
+
 def bresenham(x0, y0, x1, y1):
 	"""
 	calculate coordinates of a line between two integer coordinates in 2D
@@ -60,4 +63,57 @@ def bresenham(x0, y0, x1, y1):
 	if swapped:
 		points.reverse()
 
-	return points
\ No newline at end of file
+	return points
+
+
+def bresenham_batch(x0, y0, x1, y1):
+	"""
+	calculate coordinates of many lines between integer coordinates in 2D
+	at once, cell for cell identical to bresenham()
+	@param: integer arrays of start coordinates (x0, y0) and end coordinates
+			(x1, y1), one entry per line
+	@result: returns the concatenated coordinate arrays (x, y) of all lines
+			 and an offsets array such that line k covers the cells
+			 offsets[k]:offsets[k+1]
+	"""
+	x0, y0, x1, y1 = np.broadcast_arrays(*(np.atleast_1d(np.asarray(c, dtype=np.int64)) for c in (x0, y0, x1, y1)))
+
+	# Rotate lines which are steep
+	is_steep = np.abs(y1 - y0) > np.abs(x1 - x0)
+	a0 = np.where(is_steep, y0, x0)
+	b0 = np.where(is_steep, x0, y0)
+	a1 = np.where(is_steep, y1, x1)
+	b1 = np.where(is_steep, x1, y1)
+
+	# Swap the start and end points if necessary and store swap state
+	swapped = a0 > a1
+	a0, a1 = np.where(swapped, a1, a0), np.where(swapped, a0, a1)
+	b0, b1 = np.where(swapped, b1, b0), np.where(swapped, b0, b1)
+
+	# Recalculate differentials
+	da = a1 - a0
+	db = np.abs(b1 - b0)
+	bstep = np.where(b0 < b1, 1, -1)
+	error = da // 2
+
+	# Lay out one slot per generated point
+	lengths = da + 1
+	offsets = np.zeros(lengths.size + 1, dtype=np.int64)
+	np.cumsum(lengths, out=offsets[1:])
+	line = np.repeat(np.arange(lengths.size), lengths)
+	step = np.arange(offsets[-1]) - offsets[line]
+
+	# Points are generated from the end if the coordinates were swapped
+	k = np.where(swapped[line], da[line] - step, step)
+
+	# The error term decreases by db on every step and is raised by da
+	# whenever it becomes negative, so the number of increments of the
+	# minor coordinate after k steps is ceil((k * db - error) / da)
+	increments = (k * db[line] - error[line] + da[line] - 1) // np.maximum(da[line], 1)
+	a = a0[line] + k
+	b = b0[line] + bstep[line] * np.where(da[line] > 0, increments, 0)
+
+	# Rotate steep lines back
+	x = np.where(is_steep[line], b, a)
+	y = np.where(is_steep[line], a, b)
+	return x, y, offsets
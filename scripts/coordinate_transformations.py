@@ -1,4 +1,8 @@
-"""Functions to transform world coordinates to grid coordinates and back."""
+"""Functions to transform world coordinates to grid coordinates and back,
+for single points and for whole arrays of points."""
+
+import numpy as np
+
 
 def world_to_grid(x,y,origin_x,origin_y,width,height,resolution):
     """Returns grid cell from given world coordinates.
@@ -51,4 +55,58 @@ def grid_to_world(gx: int,gy: int,origin_x,origin_y,width,height,resolution):
     else:
         x = origin_x + (gx + 0.5)*resolution
         y = origin_y + (gy + 0.5)*resolution
-        return (x, y)
\ No newline at end of file
+        return (x, y)
+
+def world_to_grid_batch(x, y, origin_x, origin_y, width, height, resolution):
+    """Returns grid cells from given arrays of world coordinates, applying the rules of world_to_grid to every point.
+
+    Args:
+        x (array_like): positions in world coordinates
+        y (array_like): positions in world coordinates
+        origin_x: defining the bottom left corner of the grid in world coordinates
+        origin_y: defining the bottom left corner of the grid in world coordinates
+        width: width of map in world units
+        height: height of map in world units
+        resolution: the size of each grid cell in world units
+
+    Returns:
+        tuple of arrays: (i, j, valid) - integer index positions in the grid and a boolean mask
+        which is False where the input is out of bounds, in which case i and j are set to -1.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = (x >= origin_x) & (y >= origin_y) & (x <= origin_x+width) & (y <= origin_y+height)
+
+    i = np.full(valid.shape, -1, dtype=int)
+    j = np.full(valid.shape, -1, dtype=int)
+    i[valid] = ((x[valid]-origin_x)/resolution).astype(int)
+    j[valid] = ((y[valid]-origin_y)/resolution).astype(int)
+    # if on edge of grid, move inwards
+    i[valid & ((x-origin_x) == width)] -= 1
+    j[valid & ((y-origin_y) == height)] -= 1
+    return i, j, valid
+
+
+def grid_to_world_batch(gx, gy, origin_x, origin_y, width, height, resolution):
+    """Is given arrays of positions in the grid and returns the positions in world coordinates, applying the rules of grid_to_world to every cell.
+
+    Args:
+        gx (array_like): x positions in grid
+        gy (array_like): y positions in grid
+        origin_x: defining the bottom left corner of the grid in world coordinates
+        origin_y: defining the bottom left corner of the grid in world coordinates
+        width: width of map in world units
+        height: height of map in world units
+        resolution: the size (under the assumption of square sized grid cells) of each grid cell in world units
+
+    Returns:
+        tuple of arrays: (x, y, valid) - centre positions in the given grid cells in world coordinates and a
+        boolean mask which is False where the input is out of grid, in which case x and y are set to NaN.
+    """
+    gx = np.asarray(gx)
+    gy = np.asarray(gy)
+    valid = (gx >= 0) & (gy >= 0) & (gx + 1 <= width/resolution) & (gy + 1 <= height/resolution) #indexed from zero
+
+    x = np.where(valid, origin_x + (gx + 0.5)*resolution, np.nan)
+    y = np.where(valid, origin_y + (gy + 0.5)*resolution, np.nan)
+    return x, y, valid
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+"""
+Motion compensation (deskewing) of laser scans: the laser scanner sweeps
+its rays over the scan period while the robot moves, so every ray is
+given the pose the laser scanner had when that ray was measured.
+"""
+
+import numpy as np
+
+
+def deskew_poses(pose_buffer, stamp, n_rays, time_increment, laser_offset, tolerance=0.0):
+    """
+    Interpolates the pose of the laser scanner for every ray of a scan
+    @param: pose_buffer - PoseBuffer of stamped robot poses
+    @param: stamp - time stamp of the scan, i.e. of its first ray [s]
+    @param: n_rays - number of rays in the scan
+    @param: time_increment - time between the measurements of consecutive rays [s]
+    @param: laser_offset - position of the laser scanner along the x-axis of the robot [m]
+    @param: tolerance - rays stamped at most this far outside of the buffered
+            poses get the oldest or newest pose [s]
+    @result: returns the arrays (x, y, yaw) of laser scanner poses, one
+             entry per ray, None if the scan is not covered by the buffer
+    """
+    stamps = stamp + np.arange(n_rays) * time_increment
+    x, y, yaw, valid = pose_buffer.lookup_many(stamps, tolerance)
+    if not valid.all():
+        return None
+
+    # shift the robot poses to the laser frame
+    return x + np.cos(yaw) * laser_offset, y + np.sin(yaw) * laser_offset, yaw
@@ -0,0 +1,114 @@
+"""Functions to write and read occupancy grid maps in the map_server format (PGM image + YAML metadata)."""
+
+import os
+
+import numpy as np
+
+
+def save_map(yaml_path, occupancy, resolution, origin, occupied_thresh=0.65, free_thresh=0.196):
+    """Writes an occupancy grid as map.pgm/map.yaml pair readable by map_server, the same way map_saver does.
+
+    Args:
+        yaml_path: path of the YAML file to write, the PGM image is written next to it with the same base name,
+            missing directories are created
+        occupancy (np.ndarray): 2D int8 array of occupancies in [0, 100], -1 for unknown cells, indexed [y, x]
+        resolution: the size of each grid cell in world units
+        origin: [x, y] position of the bottom left corner of the grid in world coordinates
+        occupied_thresh: cells with an occupancy probability above this threshold are written as occupied
+        free_thresh: cells with an occupancy probability below this threshold are written as free
+
+    Returns:
+        str: path of the written PGM image
+    """
+    # imported here so that the map classes can be imported without it
+    import yaml
+
+    image_path = os.path.splitext(yaml_path)[0] + ".pgm"
+    os.makedirs(os.path.dirname(os.path.abspath(yaml_path)), exist_ok=True)
+
+    # map_saver colours: free 254, occupied 0, unknown 205
+    occupancy = np.asarray(occupancy)
+    pixels = np.full(occupancy.shape, 205, dtype=np.uint8)
+    pixels[(occupancy >= 0) & (occupancy <= free_thresh * 100)] = 254
+    pixels[occupancy >= occupied_thresh * 100] = 0
+
+    # the first image row is the top of the map
+    with open(image_path, "wb") as image_file:
+        image_file.write(b"P5\n# CREATOR: map_io.py %.3f m/pix\n%d %d\n255\n"
+                         % (resolution, occupancy.shape[1], occupancy.shape[0]))
+        image_file.write(np.ascontiguousarray(pixels[::-1]).tobytes())
+
+    metadata = {
+        "image": os.path.basename(image_path),
+        "resolution": float(resolution),
+        "origin": [float(origin[0]), float(origin[1]), 0.0],
+        "negate": 0,
+        "occupied_thresh": float(occupied_thresh),
+        "free_thresh": float(free_thresh),
+    }
+    with open(yaml_path, "w") as yaml_file:
+        yaml.safe_dump(metadata, yaml_file, default_flow_style=None, sort_keys=False)
+
+    return image_path
+
+
+def read_pgm(image_path):
+    """Reads a binary (P5) PGM image with 8 bit pixels.
+
+    Args:
+        image_path: path of the PGM image
+
+    Returns:
+        np.ndarray: 2D uint8 array of pixels, the first row is the top of the image
+    """
+    with open(image_path, "rb") as image_file:
+        data = image_file.read()
+
+    # header fields separated by whitespace, with comments starting with '#'
+    fields = []
+    position = 0
+    while len(fields) < 4:
+        while data[position:position + 1].isspace():
+            position += 1
+        if data[position:position + 1] == b"#":
+            position = data.index(b"\n", position) + 1
+            continue
+        end = position
+        while end < len(data) and not data[end:end + 1].isspace():
+            end += 1
+        fields.append(data[position:end])
+        position = end
+    # a single whitespace character separates the header from the pixels
+    position += 1
+
+    magic, width, height, max_value = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+    if magic != b"P5" or max_value > 255:
+        raise ValueError(f"{image_path} is not a binary PGM image with 8 bit pixels")
+    return np.frombuffer(data, dtype=np.uint8, count=width * height, offset=position).reshape(height, width)
+
+
+def load_map(yaml_path):
+    """Reads a map.pgm/map.yaml pair the same way map_server does in trinary mode.
+
+    Args:
+        yaml_path: path of the YAML file, the image path in it is relative to this file
+
+    Returns:
+        tuple: 2D int8 array of occupancies indexed [y, x] (100 occupied, 0 free, -1 unknown),
+            the resolution and the [x, y] origin of the bottom left corner of the grid
+    """
+    import yaml
+
+    with open(yaml_path) as yaml_file:
+        metadata = yaml.safe_load(yaml_file)
+    image_path = os.path.join(os.path.dirname(yaml_path), metadata["image"])
+    pixels = read_pgm(image_path)
+
+    # occupancy probability of every pixel, dark pixels are occupied unless negated
+    occupancy_prob = pixels / 255.0 if metadata.get("negate", 0) else (255 - pixels) / 255.0
+    occupancy = np.full(pixels.shape, -1, dtype=np.int8)
+    occupancy[occupancy_prob > metadata["occupied_thresh"]] = 100
+    occupancy[occupancy_prob < metadata["free_thresh"]] = 0
+
+    # the first image row is the top of the map, the yaw of the origin is ignored
+    return occupancy[::-1], float(metadata["resolution"]), [float(metadata["origin"][0]), float(metadata["origin"][1])]
@@ -0,0 +1,1330 @@
+#!/usr/bin/env python3
+
+"""
+Occupancy grid map without any ROS dependency: the map class handles
+the probabilistic map updates from laser scans in NumPy, the ROS node
+in OGMapping.py converts its content into messages. The map optionally
+maintains coarser max-pooled levels, an inflated costmap and the
+frontiers between its known and unknown cells.
+"""
+
+import copy
+import os
+
+import numpy as np
+
+from coordinate_transformations import world_to_grid_batch
+from ray_tracing import trace_rays, compiled_ray_kernel, ParallelRayTracer, RayTable
+from map_io import save_map, load_map
+
+
+class DirtyRegion:
+    """
+    Bounding box of the grid cells changed since it was last taken
+    """
+    def __init__(self):
+        """
+        class initialization
+        @param: self
+        @result: empty region
+        """
+        self.bbox = None
+
+    def mark(self, x, y):
+        """
+        Extends the region to cover the given cells
+        @param: x, y - index arrays of the changed cells
+        @result: bounding box grown to include all given cells
+        """
+        if len(x) == 0:
+            return
+        x_min, x_max, y_min, y_max = int(x.min()), int(x.max()), int(y.min()), int(y.max())
+        if self.bbox is not None:
+            x_min = min(x_min, self.bbox[0])
+            y_min = min(y_min, self.bbox[1])
+            x_max = max(x_max, self.bbox[2])
+            y_max = max(y_max, self.bbox[3])
+        self.bbox = (x_min, y_min, x_max, y_max)
+
+    def take(self):
+        """
+        Returns the region and resets it
+        @param: self
+        @result: inclusive bounding box (x_min, y_min, x_max, y_max) of
+                 the changed cells, None if nothing changed
+        """
+        bbox, self.bbox = self.bbox, None
+        return bbox
+
+
+class OccupancyPyramid:
+    """
+    Max-pooled occupancy pyramid of a map, a cell of level k covers
+    2^k x 2^k map cells and holds the highest occupancy among them,
+    it is unknown (-1) only if all of them are unknown.
+    The levels are updated from the cells changed since the last update
+    """
+    def __init__(self, occ_map, levels):
+        """
+        class initialization
+        @param: self
+        @param: occ_map - OGMap the pyramid is built from
+        @param: levels - number of levels above the map, level k has
+                a resolution 2^k times coarser than the map
+        @result: empty pyramid, built at the first update
+        """
+        self.occ_map = occ_map
+        self.levels = levels
+        self.dirty_region = occ_map.trackChanges()
+
+        # map extent the levels have been built for, and for every level
+        # its inclusive cell bounds and int8 occupancies indexed [y, x]
+        self.map_extent = None
+        self.extents = []
+        self.grids = []
+
+    def update(self):
+        """
+        Pools the cells changed since the last update into all levels
+        @param: self
+        @result: returns True if the levels have changed
+        """
+        bbox = self.dirty_region.take()
+        extent = self.occ_map.extent()
+        if extent != self.map_extent:
+            # first update or the map has grown, all levels are rebuilt
+            self.map_extent = extent
+            self.extents = [tuple(bound // 2 ** k for bound in extent) for k in range(1, self.levels + 1)]
+            self.grids = [np.full((y_max - y_min + 1, x_max - x_min + 1), -1, dtype=np.int8)
+                          for x_min, y_min, x_max, y_max in self.extents]
+            bbox = extent
+        elif bbox is None:
+            return False
+
+        source_extent = extent
+        for level in range(self.levels):
+            # cells of this level covering the changed cells of the level below
+            bbox = tuple(bound // 2 for bound in bbox)
+            x_min, y_min, x_max, y_max = bbox
+
+            # the level below over these cells, padded with unknown cells at the map border
+            source = np.full((2 * (y_max - y_min + 1), 2 * (x_max - x_min + 1)), -1, dtype=np.int8)
+            x0, y0 = max(2 * x_min, source_extent[0]), max(2 * y_min, source_extent[1])
+            x1, y1 = min(2 * x_max + 1, source_extent[2]), min(2 * y_max + 1, source_extent[3])
+            if level == 0:
+                below = self.occ_map.occupancy(x0, y0, x1, y1)
+            else:
+                below = self.grids[level - 1][y0 - source_extent[1]:y1 - source_extent[1] + 1,
+                                              x0 - source_extent[0]:x1 - source_extent[0] + 1]
+            source[y0 - 2 * y_min:y1 - 2 * y_min + 1, x0 - 2 * x_min:x1 - 2 * x_min + 1] = below
+
+            # max-pooling of every 2 x 2 block
+            level_extent = self.extents[level]
+            self.grids[level][y_min - level_extent[1]:y_max - level_extent[1] + 1,
+                              x_min - level_extent[0]:x_max - level_extent[0] + 1] = \
+                source.reshape(y_max - y_min + 1, 2, x_max - x_min + 1, 2).max(axis=(1, 3))
+            source_extent = level_extent
+        return True
+
+
+def obstacle_distances(obstacles, max_cells):
+    """
+    Euclidean distances of the cells to the closest obstacle cell, computed
+    separably (along the columns, then along the rows) over a window of
+    +-max_cells around every cell
+    @param: obstacles - 2D mask of the obstacle cells
+    @param: max_cells - largest distance computed [cells]
+    @result: returns the 2D float32 array of distances [cells], inf for
+             the cells farther than max_cells from any obstacle
+    """
+    height, width = obstacles.shape
+
+    # squared distances to the closest obstacle in the same column
+    column = np.full((height, width), np.inf)
+    for dy in range(-min(max_cells, height - 1), min(max_cells, height - 1) + 1):
+        rows, source_rows = slice(max(-dy, 0), height - max(dy, 0)), slice(max(dy, 0), height - max(-dy, 0))
+        np.minimum(column[rows], np.where(obstacles[source_rows], float(dy * dy), np.inf), out=column[rows])
+
+    # squared distances over the columns of the row
+    distances = np.full((height, width), np.inf)
+    for dx in range(-min(max_cells, width - 1), min(max_cells, width - 1) + 1):
+        cols, source_cols = slice(max(-dx, 0), width - max(dx, 0)), slice(max(dx, 0), width - max(-dx, 0))
+        np.minimum(distances[:, cols], column[:, source_cols] + dx * dx, out=distances[:, cols])
+
+    distances = np.sqrt(distances).astype(np.float32)
+    distances[distances > max_cells] = np.inf
+    return distances
+
+
+def footprint_radii(footprint):
+    """
+    Returns the inscribed and circumscribed radii [m] of a robot footprint
+    @param: footprint - corners [[x, y], ...] of the robot outline around the robot base [m]
+    """
+    corners = np.asarray(footprint, dtype=float)
+    edges = np.roll(corners, -1, axis=0) - corners
+    # distances of the robot base to the edges of the outline
+    along = np.clip(np.einsum('ij,ij->i', -corners, edges) / np.einsum('ij,ij->i', edges, edges), 0, 1)
+    inscribed = np.hypot(*(corners + along[:, None] * edges).T).min()
+    return float(inscribed), float(np.hypot(*corners.T).max())
+
+
+class DistanceField:
+    """
+    Distances of the map cells to the closest obstacle and the costs inflated
+    around the obstacles from them, as in a navigation costmap. The distances
+    are recomputed only around the cells which became or stopped being an obstacle
+    @input: occupancies of the map cells changed since the last update
+    @output: costs between 0 and 100 as 2D int8 array over the map extent,
+             100 for the obstacles, 99 within the inscribed radius of the robot,
+             decreasing exponentially to 0 at the inflation radius, -1 for
+             the unknown cells out of reach of any obstacle
+    """
+    def __init__(self, occ_map, inscribed_radius, inflation_radius, cost_scaling_factor=10.0, occupied_thresh=65):
+        """
+        class initialization
+        @param: self
+        @param: occ_map - OGMap the distances are computed for
+        @param: inscribed_radius - radius of the largest circle within the robot footprint [m]
+        @param: inflation_radius - distance to the obstacles up to which the cells have a cost [m]
+        @param: cost_scaling_factor - exponential decrease of the costs beyond the inscribed radius [1/m]
+        @param: occupied_thresh - occupancy from which a cell is an obstacle
+        @result: empty field, built at the first update
+        """
+        self.occ_map = occ_map
+        self.inscribed_radius = inscribed_radius
+        self.inflation_radius = inflation_radius
+        self.cost_scaling_factor = cost_scaling_factor
+        self.occupied_thresh = occupied_thresh
+        self.max_cells = int(np.ceil(inflation_radius / occ_map.resolution))
+        self.dirty_region = occ_map.trackChanges()
+
+        # map extent the field has been built for, and over it the obstacle and
+        # unknown masks, the distances [cells] and the costs indexed [y, x]
+        self.map_extent = None
+        self.obstacles = None
+        self.unknown = None
+        self.distances = None
+        self.costs = None
+
+        ### cells whose cost changed since the costs were last taken ###
+        self.changed_region = DirtyRegion()
+        # extent of the last taken costs
+        self.published_extent = None
+
+    def update(self):
+        """
+        Recomputes the distances and costs around the cells changed since the last update
+        @param: self
+        @result: returns True if the costs have changed
+        """
+        bbox = self.dirty_region.take()
+        extent = self.occ_map.extent()
+        if extent != self.map_extent:
+            # first update or the map has grown, the whole field is rebuilt
+            self.map_extent = extent
+            shape = (extent[3] - extent[1] + 1, extent[2] - extent[0] + 1)
+            self.obstacles = np.zeros(shape, dtype=bool)
+            self.unknown = np.ones(shape, dtype=bool)
+            self.distances = np.full(shape, np.inf, dtype=np.float32)
+            self.costs = np.full(shape, -1, dtype=np.int8)
+            bbox = extent
+        elif bbox is None:
+            return False
+
+        # changed cells in field coordinates
+        x_min, y_min = bbox[0] - extent[0], bbox[1] - extent[1]
+        x_max, y_max = bbox[2] - extent[0], bbox[3] - extent[1]
+        changed = (slice(y_min, y_max + 1), slice(x_min, x_max + 1))
+        occupancy = self.occ_map.occupancy(*bbox)
+        obstacles = occupancy >= self.occupied_thresh
+        flipped_y, flipped_x = np.nonzero(obstacles != self.obstacles[changed])
+        self.obstacles[changed] = obstacles
+        self.unknown[changed] = occupancy < 0
+        self._updateCosts(x_min, y_min, x_max, y_max)
+
+        if flipped_x.size:
+            # the distances can only change within max_cells of the flipped cells, and
+            # only the obstacles within max_cells of these cells are their closest ones
+            height, width = self.obstacles.shape
+            reach = self.max_cells
+            x0, x1 = max(x_min + flipped_x.min() - reach, 0), min(x_min + flipped_x.max() + reach, width - 1)
+            y0, y1 = max(y_min + flipped_y.min() - reach, 0), min(y_min + flipped_y.max() + reach, height - 1)
+            sx0, sx1 = max(x0 - reach, 0), min(x1 + reach, width - 1)
+            sy0, sy1 = max(y0 - reach, 0), min(y1 + reach, height - 1)
+            distances = obstacle_distances(self.obstacles[sy0:sy1 + 1, sx0:sx1 + 1], reach)
+            self.distances[y0:y1 + 1, x0:x1 + 1] = distances[y0 - sy0:y1 - sy0 + 1, x0 - sx0:x1 - sx0 + 1]
+            self._updateCosts(x0, y0, x1, y1)
+        return True
+
+    def _updateCosts(self, x_min, y_min, x_max, y_max):
+        """
+        Derives the costs of a region from its distances, given by its inclusive field cell bounds
+        """
+        region = (slice(y_min, y_max + 1), slice(x_min, x_max + 1))
+        distances = self.distances[region] * self.occ_map.resolution
+        costs = np.minimum(98 * np.exp(-self.cost_scaling_factor * (distances - self.inscribed_radius)),
+                           98).astype(np.int8)
+        costs[distances <= self.inscribed_radius] = 99
+        costs[distances == 0] = 100
+        costs[distances > self.inflation_radius] = 0
+        costs[(costs == 0) & self.unknown[region]] = -1
+        self.costs[region] = costs
+        self.changed_region.mark(np.array([x_min, x_max]) + self.map_extent[0],
+                                 np.array([y_min, y_max]) + self.map_extent[1])
+
+
+class FrontierDetector:
+    """
+    Frontier cells of a map, the free cells next to an unknown cell, grouped
+    into clusters which are the goals of frontier-based exploration. The
+    frontier mask is only updated around the cells changed since the last update
+    @input: occupancies of the map cells changed since the last update
+    @output: clusters of 8-connected frontier cells with their centroid, size
+             and goal (the frontier cell closest to the centroid)
+    """
+    def __init__(self, occ_map, min_size=1, free_thresh=40):
+        """
+        class initialization
+        @param: self
+        @param: occ_map - OGMap the frontiers are detected in
+        @param: min_size - number of cells below which a cluster is ignored
+        @param: free_thresh - occupancy below which an observed cell is free
+        @result: empty frontier mask, built at the first update
+        """
+        self.occ_map = occ_map
+        self.min_size = min_size
+        self.free_thresh = free_thresh
+        self.dirty_region = occ_map.trackChanges()
+
+        # map extent the mask has been built for, and the mask of the frontier cells over it
+        self.map_extent = None
+        self.frontier = None
+
+    def update(self):
+        """
+        Updates the frontier mask around the cells changed since the last update
+        @param: self
+        @result: returns True if the frontier mask may have changed
+        """
+        bbox = self.dirty_region.take()
+        extent = self.occ_map.extent()
+        if extent != self.map_extent:
+            # first update or the map has grown, the whole mask is rebuilt
+            self.map_extent = extent
+            self.frontier = np.zeros((extent[3] - extent[1] + 1, extent[2] - extent[0] + 1), dtype=bool)
+            bbox = extent
+        elif bbox is None:
+            return False
+
+        # the changed cells and their neighbours may change their frontier state
+        x_min, y_min = max(bbox[0] - 1, extent[0]), max(bbox[1] - 1, extent[1])
+        x_max, y_max = min(bbox[2] + 1, extent[2]), min(bbox[3] + 1, extent[3])
+
+        # occupancies of these cells and of their neighbours, the cells beyond the extent
+        # of the tiled map are unknown while there is nothing beyond the dense map
+        beyond = np.array([extent[0] - 1])
+        padding = -1 if self.occ_map.contains(beyond, beyond)[0] else 100
+        occupancy = np.full((y_max - y_min + 3, x_max - x_min + 3), padding, dtype=np.int8)
+        x0, y0 = max(x_min - 1, extent[0]), max(y_min - 1, extent[1])
+        x1, y1 = min(x_max + 1, extent[2]), min(y_max + 1, extent[3])
+        occupancy[y0 - y_min + 1:y1 - y_min + 2, x0 - x_min + 1:x1 - x_min + 2] = \
+            self.occ_map.occupancy(x0, y0, x1, y1)
+
+        # free cells with an unknown cell among their 4 neighbours
+        unknown = occupancy < 0
+        free = (occupancy[1:-1, 1:-1] >= 0) & (occupancy[1:-1, 1:-1] < self.free_thresh)
+        self.frontier[y_min - extent[1]:y_max - extent[1] + 1, x_min - extent[0]:x_max - extent[0] + 1] = \
+            free & (unknown[:-2, 1:-1] | unknown[2:, 1:-1] | unknown[1:-1, :-2] | unknown[1:-1, 2:])
+        return True
+
+    def clusters(self):
+        """
+        Groups the frontier cells into clusters of 8-connected cells
+        @param: self
+        @result: returns the cell indices (x, y) of the frontier cells in map cells
+                 and the cluster label of every cell, numbered from 0
+        """
+        cells_y, cells_x = np.nonzero(self.frontier)
+        width = self.frontier.shape[1]
+        # row-major keys of the cells, sorted as returned by np.nonzero
+        keys = cells_y * width + cells_x
+
+        # pairs of neighbouring frontier cells, every pair is found from its first cell
+        first, second = [], []
+        for dx, dy in ((1, 0), (-1, 1), (0, 1), (1, 1)):
+            inside = (cells_x + dx >= 0) & (cells_x + dx < width)
+            neighbours = keys[inside] + dy * width + dx
+            index = np.minimum(np.searchsorted(keys, neighbours), max(keys.size - 1, 0))
+            found = keys[index] == neighbours if keys.size else np.zeros(0, dtype=bool)
+            first.append(np.flatnonzero(inside)[found])
+            second.append(index[found])
+        first, second = np.concatenate(first), np.concatenate(second)
+
+        # every cell takes the lowest label of its neighbours until the labels settle,
+        # following the labels of the labels lets them spread along long frontiers
+        labels = np.arange(keys.size)
+        while True:
+            settled = labels.copy()
+            np.minimum.at(settled, first, labels[second])
+            np.minimum.at(settled, second, labels[first])
+            settled = settled[settled]
+            if np.array_equal(settled, labels):
+                break
+            labels = settled
+        return cells_x + self.map_extent[0], cells_y + self.map_extent[1], np.unique(labels, return_inverse=True)[1]
+
+
+class OGMap:
+    """
+    Map class which translates the laser ranges into grid cell
+    occupancies
+    @input: map metadata (height, width, resolution, origin)
+    @input: sensor model (reading probability, below reading probability, tau)
+    @input: laser ranges and laser metadata (min / max angles,
+            angle increments, min / max ranges)
+    @output: updated occupancy grid map as 2D np.array()
+    """
+    def __init__(self, height, width, resolution, map_origin, tau, r_prob, below_r_prob,
+                 storage="float64", logodds_resolution=0.05, logodds_min=None, logodds_max=None,
+                 pyramid_levels=0, map_file=None, map_session=None, workers=1, scan_preprocessor=None, ray_table_bins=0,
+                 jit=False, decay_half_life=None, inscribed_radius=0.0, inflation_radius=0.0,
+                 cost_scaling_factor=10.0, frontier_min_size=0):
+        """
+        class initialization
+        @param: self
+        @param: height - map size along y-axis [m]
+        @param: width - map size along x-axis [m]
+        @param: resolution - size of a grid cell [m]
+        @param: map_origin - origin in real world [m, m]
+        @param: reading probability
+        @param: below reading probability
+        @param: tau - depth of the reading point
+        @param: storage - data type of the logodds map, "float64" or the
+                fixed-point types "int16" and "int8"
+        @param: logodds_resolution - logodds step of one fixed-point unit
+        @param: logodds_min, logodds_max - bounds the logodds are clamped to
+                after every scan, None for no clamping
+        @param: pyramid_levels - number of max-pooled levels maintained above the map
+        @param: map_file - path prefix of the files the logodds map and the observed mask
+                are memory-mapped to, a previous map with the same parameters is resumed,
+                None to keep the map in memory only
+        @param: map_session - identifier stored with the map files, a previous map is only
+                resumed from files of the same session, None to resume any previous map
+        @param: workers - number of processes tracing the laser rays, 1 to trace
+                them in the calling process
+        @param: scan_preprocessor - ScanPreprocessor selecting the rays to trace,
+                None to trace every ray within the allowed range
+        @param: ray_table_bins - number of quantized ray directions the crossed cells
+                are looked up for, 0 to trace every ray exactly
+        @param: jit - trace the rays and update the crossed cells in one compiled kernel
+                if numba is installed, for float storage without ray table and workers
+        @param: decay_half_life - time [s] in which the logodds of a cell not observed
+                anymore decay halfway back to the unknown prior, None for no decay.
+                The time is given by the stamps of the scans
+        @param: inscribed_radius - radius of the largest circle within the robot footprint [m]
+        @param: inflation_radius - distance to the obstacles up to which the costmap
+                cells have a cost [m], 0 for no distance field and costmap
+        @param: cost_scaling_factor - exponential decrease of the costs beyond the inscribed radius [1/m]
+        @param: frontier_min_size - number of cells below which a frontier cluster is
+                ignored, 0 for no frontier detection
+        @result: initializes the logg odds variable based on sensor model
+        """
+        ### get map metadata ###
+        self.height = height
+        self.width = width
+        self.resolution = resolution
+        self.map_origin = map_origin
+        self.map_file = map_file
+        self.map_session = map_session
+
+        ### define probabilities for Bayesian belief update ###
+        ### get sensor model ###
+        self.tau = tau
+        self.r_prob = r_prob
+        self.below_r_prob = below_r_prob
+
+        ### define logood variables ###
+        self.odds_r_prob = np.log(self.r_prob / (1 - self.r_prob))
+        self.odds_below_r_prob = np.log(self.below_r_prob / (1 - self.below_r_prob))
+
+        ### storage of the logodds ###
+        # fixed-point storage holds the logodds in steps of logodds_scale
+        self.storage = np.dtype(storage)
+        if self.storage.kind == 'f':
+            self.logodds_scale = 1.0
+        elif self.storage in (np.int16, np.int8):
+            self.logodds_scale = logodds_resolution
+        else:
+            raise ValueError(f"unsupported logodds storage {storage}, use float64, int16 or int8")
+
+        # clamping bounds in storage units
+        self.logodds_bounds = None
+        if logodds_min is not None or logodds_max is not None:
+            self.logodds_bounds = (self.toStorage(-np.inf if logodds_min is None else logodds_min),
+                                   self.toStorage(np.inf if logodds_max is None else logodds_max))
+
+        # logodds increments of the observations in storage units
+        self.odds_r_prob_update = self.toStorage(self.odds_r_prob)
+        self.odds_below_r_prob_update = self.toStorage(self.odds_below_r_prob)
+
+        ### time decay of the logodds towards the unknown prior ###
+        # the cells are decayed lazily, when they are updated or read, from
+        # the stamp of their last update to the stamp of the latest scan
+        self.decay_half_life = decay_half_life or None
+        self.stamp = None
+
+        ### initialize logodd grid and mask of the cells observed at least once ###
+        # the occupancy probabilities are derived from the logodds only when needed
+        self._allocate()
+
+        ### cells changed since the map was last published ###
+        self.dirty_region = DirtyRegion()
+        # further regions tracking the changes for other consumers of the map
+        self.dirty_regions = [self.dirty_region]
+        # extent of the last published map
+        self.published_extent = None
+        # number of cell updates made by the last integrated scan
+        self.last_update_cells = 0
+
+        ### selection of the rays worth tracing ###
+        self.scan_preprocessor = scan_preprocessor
+
+        ### precomputed scan geometry ###
+        # unit vectors of the beams, keyed by the scan metadata
+        self.beam_cache = None
+        # cells crossed along quantized ray directions, built with the first scan
+        self.ray_table_bins = ray_table_bins
+        self.ray_table = None
+
+        ### processes tracing the laser rays ###
+        # the grid is updated in this process in the order of the rays, so the
+        # map does not depend on the number of workers
+        self.ray_tracer = ParallelRayTracer(workers) if workers > 1 else None
+
+        ### compiled kernel fusing the ray traversal and the logodds update ###
+        # None falls back to the NumPy ray tracing
+        self.ray_kernel = None
+        if jit and self.storage.kind == 'f' and workers <= 1 and not ray_table_bins:
+            self.ray_kernel = compiled_ray_kernel()
+
+        ### derived maps kept up to date from the changed cells ###
+        self.pyramid = self.distance_field = self.frontier_detector = None
+        self.buildConsumers(pyramid_levels, inscribed_radius, inflation_radius, cost_scaling_factor,
+                            frontier_min_size)
+
+    def buildConsumers(self, pyramid_levels=0, inscribed_radius=0.0, inflation_radius=0.0,
+                       cost_scaling_factor=10.0, frontier_min_size=0):
+        """replaces the occupancy pyramid, the distance field and the frontier detector of
+            the map, e.g. to maintain them only for the snapshot which is published
+            @param: pyramid_levels, inscribed_radius, inflation_radius, cost_scaling_factor,
+                    frontier_min_size - as for the class initialization, 0 for none
+            @result: new consumers, built from the whole map at their first update
+        """
+        for consumer in (self.pyramid, self.distance_field, self.frontier_detector):
+            if consumer is not None:
+                self.dirty_regions.remove(consumer.dirty_region)
+
+        ### coarser levels of the map ###
+        self.pyramid = OccupancyPyramid(self, pyramid_levels) if pyramid_levels else None
+
+        ### distances to the obstacles and inflated costmap ###
+        self.distance_field = None
+        if inflation_radius > 0:
+            self.distance_field = DistanceField(self, inscribed_radius, inflation_radius, cost_scaling_factor)
+
+        ### boundaries between the free and the unknown cells ###
+        self.frontier_detector = FrontierDetector(self, frontier_min_size) if frontier_min_size > 0 else None
+
+    def _allocate(self):
+        """allocates the logodds map and the mask of observed cells, in memory
+            or memory-mapped to the map files
+        """
+        shape = (int(self.height / self.resolution), int(self.width / self.resolution))
+        # stamps of the last update of every cell, only kept in memory
+        self.stamps = np.zeros(shape) if self.decay_half_life else None
+        # True if the map has been resumed from existing map files
+        self.resumed = False
+        if self.map_file is None:
+            self.logodds_map = np.zeros(shape, dtype=self.storage)
+            self.observed = np.zeros(shape, dtype=bool)
+            return
+
+        # only needed for the memory-mapped map
+        import yaml
+
+        ### the map files are .npy arrays described by a metadata sidecar ###
+        logodds_path = self.map_file + ".logodds.npy"
+        observed_path = self.map_file + ".observed.npy"
+        metadata_path = self.map_file + ".yaml"
+        metadata = {"width": shape[1], "height": shape[0], "resolution": float(self.resolution),
+                    "origin": [float(self.map_origin[0]), float(self.map_origin[1])],
+                    "storage": self.storage.name, "logodds_scale": float(self.logodds_scale)}
+        if self.map_session is not None:
+            metadata["session"] = str(self.map_session)
+
+        try:
+            with open(metadata_path) as metadata_file:
+                self.resumed = yaml.safe_load(metadata_file) == metadata
+            if self.resumed:
+                # the files are mapped and not read, so resuming does not depend on the map size
+                self.logodds_map = np.lib.format.open_memmap(logodds_path, mode="r+")
+                self.observed = np.lib.format.open_memmap(observed_path, mode="r+")
+                self.resumed = (self.logodds_map.shape == shape and self.logodds_map.dtype == self.storage
+                                and self.observed.shape == shape and self.observed.dtype == bool)
+        except (OSError, ValueError, yaml.YAMLError):
+            self.resumed = False
+        if self.resumed:
+            return
+
+        # new zero-filled files, the metadata is written last so that
+        # an interrupted initialization is never resumed
+        os.makedirs(os.path.dirname(os.path.abspath(self.map_file)), exist_ok=True)
+        if os.path.exists(metadata_path):
+            os.remove(metadata_path)
+        self.logodds_map = np.lib.format.open_memmap(logodds_path, mode="w+", dtype=self.storage, shape=shape)
+        self.observed = np.lib.format.open_memmap(observed_path, mode="w+", dtype=bool, shape=shape)
+        with open(metadata_path, "w") as metadata_file:
+            yaml.safe_dump(metadata, metadata_file, default_flow_style=None, sort_keys=False)
+
+    def close(self):
+        """stops the ray tracing processes and flushes a memory-mapped map
+        """
+        if self.ray_tracer is not None:
+            self.ray_tracer.close()
+            self.ray_tracer = None
+        self.flush()
+
+    def flush(self):
+        """writes the changes of a memory-mapped map to its files, the map
+            can be updated meanwhile
+        """
+        if isinstance(self.logodds_map, np.memmap):
+            self.logodds_map.flush()
+            self.observed.flush()
+
+    def updatemap(self,laser_scan,angle_min,angle_max,angle_increment,range_min,range_max,robot_pose, yaw,
+                  stamp=None):
+        """
+        Function that updates the occupancy grid based on the laser scan ranges.
+        The logodds formulation of the Bayesian belief update is used
+        @param: laser_scan - range data from the laser range finder
+        @param: angle_min, angle_max - boundaries of the circular arc of the laser ranges
+        @param: angle_increment - angular step between consecutive laser rays
+        @param: range_min, range_max - min and max distances at which the laser range finder can detect an obstacle
+        @param: robot_pose - the planar position [x, y] of the laser scanner in world coordinates,
+                x and y may also be arrays holding one position per laser ray
+        @param: yaw - the yaw angle of the laser scanner, or an array of one angle per laser ray
+        @param: stamp - time of the laser scan [s], the clock of the decay
+        @result: updates the list of occupancy cells based on occupancy probabilities ranging from [0,100]
+        """
+        if stamp is not None:
+            self.setStamp(stamp)
+
+        ### process all rays of the laser scan at once ###
+        ranges = np.asarray(laser_scan, dtype=float)
+
+        if self.scan_preprocessor is not None:
+            # masked and decimated ranges, the rays without return end at the max range
+            idx_range, measured_range, hit = self.scan_preprocessor.select(ranges, range_min, range_max)
+        else:
+            # discard the measured ranges outside of allowed range
+            idx_range = np.flatnonzero((ranges >= range_min) & (ranges <= range_max))
+            measured_range = ranges[idx_range]
+            hit = np.ones(idx_range.size, dtype=bool)
+
+        # pose of the laser scanner for every ray
+        robot_x = np.broadcast_to(np.asarray(robot_pose[0], dtype=float), ranges.shape)[idx_range]
+        robot_y = np.broadcast_to(np.asarray(robot_pose[1], dtype=float), ranges.shape)[idx_range]
+        yaw = np.asarray(yaw, dtype=float)
+
+        ### transform robot pose into grid coordinates ###
+        robot_grid_x, robot_grid_y, robot_valid = self.worldToGrid(robot_x, robot_y)
+
+        # direction of every laser beam, the cached unit vectors of the
+        # beams are rotated by the yaw angle of the laser scanner
+        beam_cos, beam_sin = self.beamDirections(ranges.size, angle_min, angle_increment)
+        cos_yaw = np.broadcast_to(np.cos(yaw), ranges.shape)[idx_range]
+        sin_yaw = np.broadcast_to(np.sin(yaw), ranges.shape)[idx_range]
+        cos_theta = cos_yaw * beam_cos[idx_range] - sin_yaw * beam_sin[idx_range]
+        sin_theta = sin_yaw * beam_cos[idx_range] + cos_yaw * beam_sin[idx_range]
+
+        # the rays without return end at the map border if the max range lies beyond it
+        if not hit.all():
+            measured_range = np.where(hit, measured_range, np.minimum(
+                measured_range, self.borderDistance(robot_x, robot_y, cos_theta, sin_theta)))
+
+        # the line joining the robot to the object is resolved in two sections
+        # the first section are non-occupied cells ending at (target - tau)
+        # the second section are occupied cells between (target - tau) and (target + tau)
+        # the rays without return have no occupied section
+        tau = np.where(hit, self.tau, 0.0)
+        minus_x, minus_y, minus_valid = self.worldToGrid(robot_x + (measured_range - tau/2) * cos_theta,
+                                                         robot_y + (measured_range - tau/2) * sin_theta)
+        plus_x, plus_y, plus_valid = self.worldToGrid(robot_x + (measured_range + tau/2) * cos_theta,
+                                                      robot_y + (measured_range + tau/2) * sin_theta)
+
+        # keep only the rays whose start and both ends lie within the map,
+        # no ray can be traced from a robot standing outside of the map
+        valid = robot_valid & minus_valid & plus_valid
+        if self.scan_preprocessor is not None:
+            # and only one of the rays ending in the same cell
+            valid[valid] = self.scan_preprocessor.unique(minus_x[valid], minus_y[valid], hit[valid])
+
+        if not valid.any():
+            self.last_update_cells = 0
+            return
+
+        if self.ray_kernel is not None:
+            self.raysUpdate(robot_grid_x[valid], robot_grid_y[valid], minus_x[valid], minus_y[valid],
+                            plus_x[valid], plus_y[valid], hit[valid])
+            return
+
+        ### resolve the cells crossed by every ray into flat index arrays ###
+        # non-occupied cells up to (target - tau), occupied cells up to (target + tau), ray by ray
+        if self.ray_table_bins:
+            # cells looked up along the closest quantized direction
+            theta = (np.broadcast_to(yaw, ranges.shape)[idx_range][valid]
+                     + angle_min + idx_range[valid] * angle_increment)
+            cells_x, cells_y, cells_free = self.rayTable(range_max).trace(
+                theta, robot_grid_x[valid], robot_grid_y[valid], minus_x[valid], minus_y[valid],
+                plus_x[valid], plus_y[valid], hit=hit[valid])
+            # the looked up ends may be one cell off the computed ones
+            inside = self.contains(cells_x, cells_y)
+            cells_x, cells_y, cells_free = cells_x[inside], cells_y[inside], cells_free[inside]
+        else:
+            rays = (robot_grid_x[valid], robot_grid_y[valid], minus_x[valid], minus_y[valid],
+                    plus_x[valid], plus_y[valid])
+            if self.ray_tracer is not None:
+                cells_x, cells_y, cells_free = self.ray_tracer.trace(*rays, hit=hit[valid])
+            else:
+                cells_x, cells_y, cells_free = trace_rays(*rays, hit=hit[valid])
+        cells_odds = np.where(cells_free, self.odds_below_r_prob_update, self.odds_r_prob_update)
+
+        self.cellsUpdate(cells_x, cells_y, cells_odds)
+
+    @property
+    def engine(self):
+        """name of the engine tracing the rays, for the logs
+        """
+        if self.ray_kernel is not None:
+            return "numba kernel"
+        if self.ray_tracer is not None:
+            return f"numpy, {self.ray_tracer.workers} worker processes"
+        if self.ray_table_bins:
+            return f"numpy, ray table of {self.ray_table_bins} directions"
+        return "numpy"
+
+    def raysUpdate(self, start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit):
+        """traces the rays and updates the crossed cells in one pass of the compiled
+            kernel, same result as cellsUpdate of the cells listed by trace_rays
+            @param: rays in grid cells and mask of the rays which hit an obstacle, as for trace_rays
+            @result: updated logodds map and mask of observed cells
+        """
+        clamp = self.logodds_bounds is not None
+        logodds_min, logodds_max = self.logodds_bounds if clamp else (-np.inf, np.inf)
+        # the kernel decays the cells it touches, a zero half-life disables the decay
+        decaying = self.decaying()
+        stamps = self.stamps if decaying else np.zeros((1, 1))
+        # the memory-mapped arrays are passed as plain arrays of the same buffers
+        n_cells, x_min, y_min, x_max, y_max = self.ray_kernel(
+            self.logodds_map.view(np.ndarray), self.observed.view(np.ndarray),
+            start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit,
+            float(self.odds_below_r_prob_update), float(self.odds_r_prob_update),
+            clamp, float(logodds_min), float(logodds_max),
+            stamps, float(self.stamp) if decaying else 0.0, float(self.decay_half_life) if decaying else 0.0)
+        if n_cells:
+            self.markDirty(np.array([x_min, x_max]), np.array([y_min, y_max]))
+        self.last_update_cells = n_cells
+
+    def setStamp(self, stamp):
+        """advances the clock of the decay to the stamp of a scan, the first stamp
+            starts the decay of the cells already in the map (resumed or seeded)
+        """
+        if self.decay_half_life is None:
+            return
+        if self.stamp is None:
+            self._stampAll(stamp)
+        self.stamp = stamp
+
+    def _stampAll(self, stamp):
+        """sets the stamp of the last update of all cells
+        """
+        self.stamps[...] = stamp
+
+    def decaying(self):
+        """returns True if the logodds decay, which starts with the first stamped scan
+        """
+        return self.decay_half_life is not None and self.stamp is not None
+
+    def decayFactor(self, stamps):
+        """returns the factors by which the logodds last updated at the given
+            stamps have decayed until the latest scan
+        """
+        return np.exp2(-np.maximum(self.stamp - stamps, 0.0) / self.decay_half_life)
+
+    def _decayed(self, logodds, factor):
+        """returns logodds in storage units scaled by decay factors, rounded to
+            the fixed-point steps for integer storage
+        """
+        if self.storage.kind == 'f':
+            return logodds * factor
+        return np.rint(logodds * factor).astype(self.storage)
+
+    def beamDirections(self, n_beams, angle_min, angle_increment):
+        """returns the unit vectors (cos, sin) of the beams of a scan relative to the
+            laser scanner, cached as long as the scan metadata does not change
+        """
+        key = (n_beams, angle_min, angle_increment)
+        if self.beam_cache is None or self.beam_cache[0] != key:
+            angles = angle_min + np.arange(n_beams) * angle_increment
+            self.beam_cache = (key, np.cos(angles), np.sin(angles))
+        return self.beam_cache[1:]
+
+    def rayTable(self, range_max):
+        """returns the RayTable of the quantized ray directions, rebuilt when the max range changes
+        """
+        if self.ray_table is None or self.ray_table.max_range < range_max + self.tau:
+            self.ray_table = RayTable(self.ray_table_bins, range_max + self.tau, self.resolution)
+        return self.ray_table
+
+    def contains(self, x, y):
+        """returns the mask of the cells lying within the map
+        """
+        return (x >= 0) & (y >= 0) & (x < self.logodds_map.shape[1]) & (y < self.logodds_map.shape[0])
+
+    def borderDistance(self, x, y, cos_theta, sin_theta):
+        """returns the distances from positions within the map to the map border
+            @param: x, y - arrays of positions in world coordinates
+            @param: cos_theta, sin_theta - arrays of the directions to the border
+            @result: array of distances [m], slightly short of the border so
+                     that the points at these distances lie within the map
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            to_x = np.where(cos_theta > 0, self.map_origin[0] + self.width - x,
+                            x - self.map_origin[0]) / np.abs(cos_theta)
+            to_y = np.where(sin_theta > 0, self.map_origin[1] + self.height - y,
+                            y - self.map_origin[1]) / np.abs(sin_theta)
+        return np.fmin(to_x, to_y) - 1e-3 * self.resolution
+
+    def toStorage(self, logodds):
+        """converts logodds into the storage representation of the logodds map
+            @param: logodds - logodds value
+            @result: the value in storage units, rounded to the nearest fixed-point
+                     step and saturated to the range of integer storage types
+        """
+        if self.storage.kind == 'f':
+            return self.storage.type(logodds)
+        limits = np.iinfo(self.storage)
+        return self.storage.type(np.clip(np.rint(logodds / self.logodds_scale), limits.min, limits.max))
+
+    def worldToGrid(self, x, y):
+        """converts arrays of world coordinates into cell indices of the map
+            @param: x, y - arrays of positions in world coordinates
+            @result: integer index arrays (x, y) and a mask of the
+                     points lying within the map
+        """
+        return world_to_grid_batch(x, y, self.map_origin[0], self.map_origin[1],
+                                   self.width, self.height, self.resolution)
+
+    def cellsUpdate(self, x, y, logodds_update):
+        """updates a batch of cells in the occupancy grid following a laser scan
+            @param: x, y - index arrays of the cells in the occupancy grid,
+                    a cell may appear several times
+            @param: logodds_update - array of observation likelihoods in logodds
+                    representation, in storage units (see toStorage)
+            @result: updated logodds map and mask of observed cells
+        """
+        if self.decaying():
+            # the decay up to this scan comes before its observations
+            self.logodds_map[y, x] = self._decayed(self.logodds_map[y, x], self.decayFactor(self.stamps[y, x]))
+            self.stamps[y, x] = self.stamp
+        self._accumulate(self.logodds_map, x, y, logodds_update)
+        self.observed[y, x] = True
+        self.markDirty(x, y)
+        self.last_update_cells = len(x)
+
+    def trackChanges(self):
+        """returns a new DirtyRegion marked with every cell changed from now on
+        """
+        dirty_region = DirtyRegion()
+        self.dirty_regions.append(dirty_region)
+        return dirty_region
+
+    def markDirty(self, x, y):
+        """marks the given cells as changed in every tracked DirtyRegion
+        """
+        for dirty_region in self.dirty_regions:
+            dirty_region.mark(x, y)
+
+    def _accumulate(self, logodds_map, x, y, logodds_update):
+        """adds the observations of a scan to an array of logodds
+            @param: logodds_map - 2D array of logodds in storage units
+            @param: x, y - index arrays of the cells in logodds_map
+            @param: logodds_update - array of observation likelihoods in storage units
+            @result: updated and clamped logodds_map
+        """
+        if self.storage.kind == 'f':
+            # accumulate the logodds in the order of the observations,
+            # repeated cells receive one increment per observation
+            np.add.at(logodds_map, (y, x), logodds_update)
+            if self.logodds_bounds is not None:
+                logodds_map[y, x] = np.clip(logodds_map[y, x], *self.logodds_bounds)
+        else:
+            # integer sums do not depend on the order, so the increments of every
+            # touched cell are summed up in a wider type before clamping
+            bounds = self.logodds_bounds or (np.iinfo(self.storage).min, np.iinfo(self.storage).max)
+            x_min, x_max, y_min, y_max = x.min(), x.max(), y.min(), y.max()
+            region_width = x_max - x_min + 1
+            region_size = region_width * (y_max - y_min + 1)
+            if region_size <= 4 * len(x):
+                # dense sums over the bounding box of the scan
+                increments = np.bincount((y - y_min) * region_width + (x - x_min), weights=logodds_update,
+                                         minlength=region_size).astype(np.int32)
+                region = logodds_map[y_min:y_max + 1, x_min:x_max + 1]
+                region[...] = np.clip(region + increments.reshape(region.shape), *bounds)
+            else:
+                # sparse sums over the touched cells only
+                cells, inverse = np.unique(np.ravel_multi_index((y, x), logodds_map.shape), return_inverse=True)
+                increments = np.bincount(inverse, weights=logodds_update, minlength=cells.size).astype(np.int32)
+                logodds = logodds_map.reshape(-1)
+                logodds[cells] = np.clip(logodds[cells] + increments, *bounds)
+
+    def cellUpdate(self, x, y, logodds_update):
+        """updates a specific cell in the occupancy grid following an observation
+            @param: x, y - indices of the cell in the occupancy grid
+            @param: logodds_update - likelihood of the observation in logodds representation
+            @result: updated logodds map and mask of observed cells
+        """
+        self.cellsUpdate(np.array([x]), np.array([y]), np.array([self.toStorage(logodds_update)]))
+
+    @property
+    def prob_map(self):
+        """occupancy probabilities of the map, -1 for the cells never observed
+        """
+        logodds, observed = self._region(*self.extent())
+        prob_map = np.full(logodds.shape, -1.0)
+        prob_map[observed] = 1 - 1 / (1 + np.exp(logodds[observed] * self.logodds_scale))
+        return prob_map
+
+    def extent(self):
+        """returns the inclusive cell bounds (x_min, y_min, x_max, y_max) of the map
+        """
+        return 0, 0, self.logodds_map.shape[1] - 1, self.logodds_map.shape[0] - 1
+
+    def _region(self, x_min, y_min, x_max, y_max):
+        """returns the logodds (in storage units) and the observed mask of a
+            region of the map given by its inclusive cell bounds
+        """
+        region = (slice(y_min, y_max + 1), slice(x_min, x_max + 1))
+        logodds = self.logodds_map[region]
+        if self.decaying():
+            logodds = self._decayed(logodds, self.decayFactor(self.stamps[region]))
+        return logodds, self.observed[region]
+
+    def occupancy(self, x_min=None, y_min=None, x_max=None, y_max=None):
+        """converts a region of the map into occupancies
+            @param: x_min, y_min, x_max, y_max - inclusive cell bounds of the region,
+                    the whole map by default
+            @result: 2D np.array() of int8 occupancies between 0 and 100 for every cell
+                     that's been seen at least once, -1 for the cells never observed
+        """
+        if x_min is None:
+            x_min, y_min, x_max, y_max = self.extent()
+        logodds, observed = self._region(x_min, y_min, x_max, y_max)
+
+        scaled_prob = np.full(logodds.shape, -1, dtype=np.int8)
+        scaled_prob[observed] = (100 * (1 - 1 / (1 + np.exp(logodds[observed] * self.logodds_scale)))).astype(np.int8)
+        return scaled_prob
+
+    def snapshot(self, snapshot=None):
+        """copies the map, so that the messages can be built from the copy while
+            this map keeps being updated. Only the cells changed since the previous
+            snapshot are copied, into the buffers of the previous snapshot
+            @param: snapshot - previous snapshot of this map, None for a new one
+            @result: returns the snapshot, in which the copied cells are marked as changed
+        """
+        bbox = self.dirty_region.take()
+        if snapshot is not None:
+            snapshot.stamp = self.stamp
+        else:
+            snapshot = copy.copy(self)
+            # own buffers and change tracking, the snapshot is never memory-mapped
+            snapshot.map_file = None
+            snapshot._allocate()
+            snapshot.dirty_region = DirtyRegion()
+            snapshot.dirty_regions = [snapshot.dirty_region]
+            snapshot.published_extent = None
+            snapshot.pyramid = OccupancyPyramid(snapshot, self.pyramid.levels) if self.pyramid else None
+            if self.distance_field is not None:
+                snapshot.distance_field = DistanceField(snapshot, self.distance_field.inscribed_radius,
+                                                        self.distance_field.inflation_radius,
+                                                        self.distance_field.cost_scaling_factor,
+                                                        self.distance_field.occupied_thresh)
+            if self.frontier_detector is not None:
+                snapshot.frontier_detector = FrontierDetector(snapshot, self.frontier_detector.min_size,
+                                                              self.frontier_detector.free_thresh)
+            snapshot.ray_tracer = None
+            bbox = self.extent()
+
+        if bbox is not None:
+            self._copyRegion(snapshot, *bbox)
+            snapshot.markDirty(np.array([bbox[0], bbox[2]]), np.array([bbox[1], bbox[3]]))
+        return snapshot
+
+    def _copyRegion(self, snapshot, x_min, y_min, x_max, y_max):
+        """copies a region of the map given by its inclusive cell bounds into a snapshot
+        """
+        region = (slice(y_min, y_max + 1), slice(x_min, x_max + 1))
+        snapshot.logodds_map[region] = self.logodds_map[region]
+        snapshot.observed[region] = self.observed[region]
+        if self.stamps is not None:
+            snapshot.stamps[region] = self.stamps[region]
+
+    def origin(self):
+        """returns the world coordinates [x, y] of the bottom left corner of the map extent
+        """
+        x_min, y_min = self.extent()[:2]
+        return [self.map_origin[0] + x_min * self.resolution, self.map_origin[1] + y_min * self.resolution]
+
+    def saveMap(self, yaml_path, occupied_thresh=0.65, free_thresh=0.196, save_logodds=False):
+        """saves the map as map.pgm/map.yaml pair readable by map_server
+            @param: yaml_path - path of the YAML file, the image is written next to it
+            @param: occupied_thresh, free_thresh - occupancy probabilities above / below
+                    which the cells are written as occupied / free
+            @param: save_logodds - also writes the logodds to a compressed .npz file
+                    next to the YAML file, so that the map can be restored exactly
+            @result: written map files
+        """
+        origin = self.origin()
+        save_map(yaml_path, self.occupancy(), self.resolution, origin, occupied_thresh, free_thresh)
+        if save_logodds:
+            logodds, observed = self._region(*self.extent())
+            np.savez_compressed(os.path.splitext(yaml_path)[0] + ".npz", logodds=logodds,
+                                logodds_scale=self.logodds_scale, observed=observed,
+                                resolution=self.resolution, origin=origin)
+
+    def seedMap(self, yaml_path):
+        """adds a saved map to the logodds, meant to start mapping from a previous map.
+            The logodds saved by saveMap are used if present, otherwise the occupied and
+            free cells of the image get the logodds of one hit and of one miss
+            @param: yaml_path - path of the map YAML file, its resolution has to match
+            @result: updated logodds map and mask of observed cells
+        """
+        logodds_path = os.path.splitext(yaml_path)[0] + ".npz"
+        if os.path.exists(logodds_path):
+            with np.load(logodds_path) as saved:
+                resolution, origin = float(saved["resolution"]), saved["origin"]
+                observed = saved["observed"]
+                logodds = self.toStorage(saved["logodds"][observed] * float(saved["logodds_scale"]))
+        else:
+            occupancy, resolution, origin = load_map(yaml_path)
+            observed = occupancy >= 0
+            logodds = np.where(occupancy[observed] == 100, self.odds_r_prob_update, self.odds_below_r_prob_update)
+
+        if not np.isclose(resolution, self.resolution):
+            raise ValueError(f"map resolution {resolution} does not match the resolution {self.resolution}")
+
+        # place the saved cells by the world coordinates of their centres
+        cells_y, cells_x = np.nonzero(observed)
+        x, y, valid = self.worldToGrid(origin[0] + (cells_x + 0.5) * resolution,
+                                       origin[1] + (cells_y + 0.5) * resolution)
+        if valid.any():
+            self.cellsUpdate(x[valid], y[valid], np.asarray(logodds)[valid])
+
+    def needsFullMap(self):
+        """returns True if the changed cells cannot be published as an update
+            of the last published map, e.g. because the map has grown since
+        """
+        if self.published_extent is None:
+            return True
+        bbox = self.dirty_region.bbox
+        return bbox is not None and not (self.published_extent[0] <= bbox[0] and self.published_extent[1] <= bbox[1]
+                                         and bbox[2] <= self.published_extent[2]
+                                         and bbox[3] <= self.published_extent[3])
+
+    def takeMap(self):
+        """returns the latest map for publication, the changes made so far are
+            considered as published
+            @result: returns the world coordinates [x, y] of the bottom left corner
+                     of the map and its occupancies as 2D int8 array indexed [y, x]
+        """
+        # the full map covers all the changes made so far
+        self.dirty_region.take()
+        self.published_extent = self.extent()
+        if self.decaying():
+            # the cells decay without being changed, the levels, the costmap
+            # and the frontiers are refreshed with the full map
+            for consumer in (self.pyramid, self.distance_field, self.frontier_detector):
+                if consumer is not None:
+                    consumer.dirty_region.mark(np.array(self.published_extent[::2]),
+                                               np.array(self.published_extent[1::2]))
+        return self.origin(), self.occupancy(*self.published_extent)
+
+    def takeMapUpdate(self):
+        """returns the cells changed since the map was last published
+            @result: returns the cell offsets (x, y) of the changed region in the
+                     last published map and its occupancies as 2D int8 array,
+                     None if nothing changed
+        """
+        bbox = self.dirty_region.take()
+        if bbox is None:
+            return None
+        x_min, y_min, x_max, y_max = bbox
+
+        # the update is placed relative to the last published map
+        return (x_min - self.published_extent[0], y_min - self.published_extent[1],
+                self.occupancy(x_min, y_min, x_max, y_max))
+
+    def takePyramid(self):
+        """returns the levels of the occupancy pyramid, coarsest last
+            @result: returns a list of (resolution, origin [x, y], 2D int8 occupancies)
+                     per level, copies of the levels which keep being updated,
+                     None if the map has not changed since the last call
+        """
+        if self.pyramid is None or not self.pyramid.update():
+            return None
+
+        levels = []
+        for level, (extent, grid) in enumerate(zip(self.pyramid.extents, self.pyramid.grids), start=1):
+            resolution = self.resolution * 2 ** level
+            levels.append((resolution, [self.map_origin[0] + extent[0] * resolution,
+                                        self.map_origin[1] + extent[1] * resolution], grid.copy()))
+        return levels
+
+    def takeCostmap(self):
+        """returns the full inflated costmap for publication, over the same extent
+            as the map, the changes of the costs made so far are considered as published
+            @result: returns the world coordinates [x, y] of the bottom left corner of
+                     the costmap and its costs as 2D int8 array indexed [y, x],
+                     None without distance field
+        """
+        if self.distance_field is None:
+            return None
+        self.distance_field.update()
+        self.distance_field.changed_region.take()
+        self.distance_field.published_extent = self.distance_field.map_extent
+        return self.origin(), self.distance_field.costs.copy()
+
+    def takeCostmapUpdate(self):
+        """returns the costs changed since the costmap was last published
+            @result: returns the cell offsets (x, y) of the changed region in the last
+                     published costmap and its costs as 2D int8 array, None if nothing
+                     changed, without distance field or if the costmap has not been
+                     published over the current map extent yet
+        """
+        if self.distance_field is None:
+            return None
+        self.distance_field.update()
+        extent = self.distance_field.published_extent
+        if extent != self.distance_field.map_extent:
+            return None
+        bbox = self.distance_field.changed_region.take()
+        if bbox is None:
+            return None
+        x_min, y_min, x_max, y_max = bbox
+        return (x_min - extent[0], y_min - extent[1],
+                self.distance_field.costs[y_min - extent[1]:y_max - extent[1] + 1,
+                                          x_min - extent[0]:x_max - extent[0] + 1].copy())
+
+    def takeFrontiers(self, robot_position=None):
+        """returns the frontier clusters ranked for exploration, nearest goal first
+            if the robot position is given, largest cluster first otherwise
+            @param: robot_position - world coordinates [x, y] of the robot, or None
+            @result: returns a list of (centroid [x, y], goal [x, y], size [cells]) per
+                     cluster, the goal being the frontier cell closest to the centroid,
+                     None if the map has not changed since the last call
+        """
+        if self.frontier_detector is None or not self.frontier_detector.update():
+            return None
+
+        cells_x, cells_y, labels = self.frontier_detector.clusters()
+        if labels.size == 0:
+            return []
+        sizes = np.bincount(labels)
+        centroid_x = np.bincount(labels, weights=cells_x) / sizes
+        centroid_y = np.bincount(labels, weights=cells_y) / sizes
+
+        # frontier cell of every cluster closest to its centroid
+        squared_distances = (cells_x - centroid_x[labels]) ** 2 + (cells_y - centroid_y[labels]) ** 2
+        order = np.lexsort((squared_distances, labels))
+        goals = order[np.r_[0, np.flatnonzero(np.diff(labels[order])) + 1]]
+
+        # world coordinates of the cell centres
+        centroids = np.stack([centroid_x, centroid_y], axis=1)
+        goals = np.stack([cells_x[goals], cells_y[goals]], axis=1)
+        centroids = np.asarray(self.map_origin) + (centroids + 0.5) * self.resolution
+        goals = np.asarray(self.map_origin) + (goals + 0.5) * self.resolution
+
+        kept = np.flatnonzero(sizes >= self.frontier_detector.min_size)
+        if robot_position is not None:
+            ranking = kept[np.argsort(np.hypot(*(goals[kept] - np.asarray(robot_position)).T), kind='stable')]
+        else:
+            ranking = kept[np.argsort(-sizes[kept], kind='stable')]
+        return [(centroids[cluster].tolist(), goals[cluster].tolist(), int(sizes[cluster])) for cluster in ranking]
+
+
+class TiledOGMap(OGMap):
+    """
+    Map class storing the grid cells in square tiles which are allocated
+    when first touched, so that the map grows in any direction from its
+    origin and its memory scales with the explored area
+    @input: map metadata (resolution, origin, tile size), height and width
+            only give the extent published before anything is observed
+    @input: sensor model and laser ranges as for OGMap
+    @output: occupancy grid over the bounding box of the allocated tiles
+    """
+    def __init__(self, height, width, resolution, map_origin, tau, r_prob, below_r_prob, tile_size=64, **kwargs):
+        """
+        class initialization
+        @param: tile_size - number of cells along each side of a tile
+        @param: other parameters as for OGMap
+        @result: empty map without any tile
+        """
+        if kwargs.get("map_file") is not None:
+            raise ValueError("the tiled map cannot be memory-mapped, use the dense backend")
+        self.tile_size = tile_size
+        # the compiled kernel only updates a dense grid
+        kwargs["jit"] = False
+        super().__init__(height, width, resolution, map_origin, tau, r_prob, below_r_prob, **kwargs)
+
+    def _allocate(self):
+        """initializes the dictionaries of tiles, keyed by tile coordinates
+        """
+        self.tiles = {}
+        self.observed_tiles = {}
+        # stamps of the last update of the cells of every tile, only with decay
+        self.tile_stamps = {}
+        self.stamps = None
+        self.resumed = False
+
+    def _tile(self, key):
+        """returns the logodds and observed mask of a tile, allocating it if needed
+        """
+        logodds = self.tiles.get(key)
+        if logodds is None:
+            logodds = self.tiles[key] = np.zeros((self.tile_size, self.tile_size), dtype=self.storage)
+            self.observed_tiles[key] = np.zeros((self.tile_size, self.tile_size), dtype=bool)
+            if self.decay_half_life:
+                self.tile_stamps[key] = np.full((self.tile_size, self.tile_size),
+                                                self.stamp if self.stamp is not None else 0.0)
+        return logodds, self.observed_tiles[key]
+
+    def worldToGrid(self, x, y):
+        """converts arrays of world coordinates into unbounded cell indices,
+            relative to the map origin
+            @param: x, y - arrays of positions in world coordinates
+            @result: integer index arrays (x, y) and a mask of the finite positions
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        valid = np.isfinite(x) & np.isfinite(y)
+
+        grid_x = np.full(valid.shape, -1, dtype=int)
+        grid_y = np.full(valid.shape, -1, dtype=int)
+        grid_x[valid] = np.floor((x[valid] - self.map_origin[0]) / self.resolution)
+        grid_y[valid] = np.floor((y[valid] - self.map_origin[1]) / self.resolution)
+        return grid_x, grid_y, valid
+
+    def cellsUpdate(self, x, y, logodds_update):
+        """updates a batch of cells following a laser scan, tile by tile
+            @param: x, y - index arrays of the cells, a cell may appear several times
+            @param: logodds_update - array of observation likelihoods in storage units
+            @result: updated logodds and observed tiles
+        """
+        tile_x = x // self.tile_size
+        tile_y = y // self.tile_size
+
+        # group the observations by tile, keeping their order within every tile
+        keys = (tile_y - tile_y.min()) * (tile_x.max() - tile_x.min() + 1) + (tile_x - tile_x.min())
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        ends = np.r_[starts[1:], keys.size]
+
+        for start, end in zip(starts, ends):
+            cells = order[start:end]
+            key = (int(tile_x[cells[0]]), int(tile_y[cells[0]]))
+            logodds, observed = self._tile(key)
+            local_x = x[cells] - key[0] * self.tile_size
+            local_y = y[cells] - key[1] * self.tile_size
+            if self.decaying():
+                # the decay up to this scan comes before its observations, only for
+                # the touched cells so that the rounding does not stall the others
+                stamps = self.tile_stamps[key]
+                logodds[local_y, local_x] = self._decayed(logodds[local_y, local_x],
+                                                          self.decayFactor(stamps[local_y, local_x]))
+                stamps[local_y, local_x] = self.stamp
+            self._accumulate(logodds, local_x, local_y, logodds_update[cells])
+            observed[local_y, local_x] = True
+
+        self.markDirty(x, y)
+        self.last_update_cells = len(x)
+
+    def flush(self):
+        """nothing to write, the tiled map is kept in memory only
+        """
+
+    def _stampAll(self, stamp):
+        """sets the stamp of the last update of all cells of all tiles
+        """
+        for stamps in self.tile_stamps.values():
+            stamps[...] = stamp
+
+    def contains(self, x, y):
+        """returns the mask of the cells lying within the map, which are all cells
+        """
+        return np.ones(np.shape(x), dtype=bool)
+
+    def borderDistance(self, x, y, cos_theta, sin_theta):
+        """returns the distances to the map border, which has none
+        """
+        return np.full(np.shape(x), np.inf)
+
+    def _copyRegion(self, snapshot, x_min, y_min, x_max, y_max):
+        """copies the tiles overlapping a region given by its inclusive cell bounds into a snapshot
+        """
+        size = self.tile_size
+        for key, logodds in self.tiles.items():
+            if x_min // size <= key[0] <= x_max // size and y_min // size <= key[1] <= y_max // size:
+                snapshot_logodds, snapshot_observed = snapshot._tile(key)
+                snapshot_logodds[...] = logodds
+                snapshot_observed[...] = self.observed_tiles[key]
+                if key in self.tile_stamps:
+                    snapshot.tile_stamps[key][...] = self.tile_stamps[key]
+
+    def extent(self):
+        """returns the inclusive cell bounds (x_min, y_min, x_max, y_max) of the
+            allocated tiles, or of the configured map size if none is allocated
+        """
+        if not self.tiles:
+            return 0, 0, int(self.width / self.resolution) - 1, int(self.height / self.resolution) - 1
+        tile_x = [key[0] for key in self.tiles]
+        tile_y = [key[1] for key in self.tiles]
+        return (min(tile_x) * self.tile_size, min(tile_y) * self.tile_size,
+                (max(tile_x) + 1) * self.tile_size - 1, (max(tile_y) + 1) * self.tile_size - 1)
+
+    def _region(self, x_min, y_min, x_max, y_max):
+        """assembles the logodds (in storage units) and the observed mask of a
+            region of the map from the tiles overlapping it
+        """
+        logodds = np.zeros((y_max - y_min + 1, x_max - x_min + 1), dtype=self.storage)
+        observed = np.zeros(logodds.shape, dtype=bool)
+
+        size = self.tile_size
+        for tile_y in range(y_min // size, y_max // size + 1):
+            for tile_x in range(x_min // size, x_max // size + 1):
+                if (tile_x, tile_y) not in self.tiles:
+                    continue
+                # overlap of the tile and the region in map cells
+                x0, x1 = max(x_min, tile_x * size), min(x_max, (tile_x + 1) * size - 1)
+                y0, y1 = max(y_min, tile_y * size), min(y_max, (tile_y + 1) * size - 1)
+                tile_slice = (slice(y0 - tile_y * size, y1 - tile_y * size + 1),
+                              slice(x0 - tile_x * size, x1 - tile_x * size + 1))
+                region_slice = (slice(y0 - y_min, y1 - y_min + 1), slice(x0 - x_min, x1 - x_min + 1))
+                tile = self.tiles[(tile_x, tile_y)][tile_slice]
+                if self.decaying():
+                    tile = self._decayed(tile, self.decayFactor(self.tile_stamps[(tile_x, tile_y)][tile_slice]))
+                logodds[region_slice] = tile
+                observed[region_slice] = self.observed_tiles[(tile_x, tile_y)][tile_slice]
+        return logodds, observed
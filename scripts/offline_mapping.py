@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+Offline mapping tool which builds the occupancy grid map of a recorded
+run as fast as the CPU allows, without a ROS master.
+The LaserScan and Odometry messages are read either from a rosbag or
+from flat recordings made with `rostopic echo` (see other/ for examples),
+integrated with the OGMap class and the final map is written as a
+map.pgm/map.yaml pair like the ones in data/maps.
+
+usage: offline_mapping.py --bag run.bag -o data/maps/map.yaml
+       offline_mapping.py --scans scans.txt --odometry odometry.txt -o map.yaml
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import yaml
+
+from occupancy_map import OGMap, TiledOGMap
+from pose_buffer import PoseBuffer
+from deskew import deskew_poses
+from scan_preprocessing import ScanPreprocessor
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "config")
+
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:
+    YamlLoader = yaml.SafeLoader
+
+
+class Scan:
+    """
+    Plain copy of the LaserScan fields used for mapping
+    """
+    def __init__(self, stamp, ranges, angle_min, angle_max, angle_increment, time_increment, range_min, range_max):
+        """
+        class initialization
+        @param: self
+        @param: stamp - time stamp of the scan [s]
+        @param: ranges - array of laser ranges [m]
+        @param: angle_min, angle_max, angle_increment, time_increment,
+                range_min, range_max - LaserScan metadata
+        """
+        self.stamp = stamp
+        self.ranges = ranges
+        self.angle_min = angle_min
+        self.angle_max = angle_max
+        self.angle_increment = angle_increment
+        self.time_increment = time_increment
+        self.range_min = range_min
+        self.range_max = range_max
+
+
+def yaw_from_quaternion(x, y, z, w):
+    """
+    returns the yaw angle of a quaternion, same as the first angle of
+    tf.transformations.euler_from_quaternion(q, axes='szyx')
+    """
+    return np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))
+
+
+def read_echo_file(path):
+    """
+    reads the messages recorded with `rostopic echo` into dictionaries
+    @param: path - text file holding YAML documents separated by '---'
+    @result: yields one dictionary per message
+    """
+    with open(path) as echo_file:
+        for message in yaml.load_all(echo_file, Loader=YamlLoader):
+            if message:
+                yield message
+
+
+def stamp_from_dict(header):
+    """
+    converts the stamp of a recorded message header
+    @param: header - header dictionary of a message recorded with `rostopic echo`
+    @result: returns the stamp [s]
+    """
+    return header["stamp"]["secs"] + 1e-9 * header["stamp"]["nsecs"]
+
+
+def scan_from_dict(message):
+    """
+    converts a LaserScan message recorded with `rostopic echo`
+    @param: message - dictionary of the message
+    @result: returns the Scan
+    """
+    return Scan(stamp_from_dict(message["header"]),
+                # rostopic echo writes inf and nan as plain strings
+                np.array([float(r) for r in message["ranges"]]),
+                message["angle_min"], message["angle_max"], message["angle_increment"],
+                message.get("time_increment", 0.0), message["range_min"], message["range_max"])
+
+
+def pose_from_dict(message):
+    """
+    converts an Odometry message recorded with `rostopic echo`
+    @param: message - dictionary of the message
+    @result: returns the stamped planar pose (stamp, x, y, yaw)
+    """
+    position = message["pose"]["pose"]["position"]
+    orientation = message["pose"]["pose"]["orientation"]
+    return (stamp_from_dict(message["header"]), position["x"], position["y"],
+            yaw_from_quaternion(orientation["x"], orientation["y"], orientation["z"], orientation["w"]))
+
+
+def scan_from_msg(message):
+    """
+    converts a LaserScan message read from a rosbag
+    @param: message - sensor_msgs LaserScan message
+    @result: returns the Scan
+    """
+    return Scan(message.header.stamp.to_sec(), np.asarray(message.ranges, dtype=float),
+                message.angle_min, message.angle_max, message.angle_increment,
+                message.time_increment, message.range_min, message.range_max)
+
+
+def pose_from_msg(message):
+    """
+    converts an Odometry message read from a rosbag
+    @param: message - nav_msgs Odometry message
+    @result: returns the stamped planar pose (stamp, x, y, yaw)
+    """
+    position = message.pose.pose.position
+    orientation = message.pose.pose.orientation
+    return (message.header.stamp.to_sec(), position.x, position.y,
+            yaw_from_quaternion(orientation.x, orientation.y, orientation.z, orientation.w))
+
+
+def read_bag(path, scan_topic, odometry_topic):
+    """
+    reads the laser scans and robot poses of a rosbag
+    @result: returns the list of poses (stamp, x, y, yaw) and the list of scans
+    """
+    # only needed for bags, so that flat recordings can be mapped without ROS
+    import rosbag
+
+    with rosbag.Bag(path) as bag:
+        poses = [pose_from_msg(message) for _, message, _ in bag.read_messages(topics=[odometry_topic])]
+        scans = [scan_from_msg(message) for _, message, _ in bag.read_messages(topics=[scan_topic])]
+    return poses, scans
+
+
+def load_config(config_dir, name):
+    """
+    reads a yaml configuration file
+    @param: config_dir - directory of the configuration files
+    @param: name - file name, e.g. map.yaml
+    @result: returns the dictionary of parameters
+    """
+    with open(os.path.join(config_dir, name)) as config_file:
+        return yaml.safe_load(config_file)
+
+
+def build_map(poses, scans, config_dir=CONFIG_DIR):
+    """
+    integrates recorded laser scans into a new occupancy grid map
+    @param: poses - list of stamped robot poses (stamp, x, y, yaw)
+    @param: scans - list of Scan objects
+    @param: config_dir - directory holding map.yaml, sensor_model.yaml,
+            robot_parameters.yaml and mapping.yaml
+    @result: returns the OGMap, the number of integrated scans and
+             the integration time [s]
+    """
+    map_params = load_config(config_dir, "map.yaml")
+    sensor_model = load_config(config_dir, "sensor_model.yaml")
+    laser_offset = load_config(config_dir, "robot_parameters.yaml")["laserscanner_pose"][0]
+    mapping_params = load_config(config_dir, "mapping.yaml")
+
+    map_kwargs = dict(storage=sensor_model.get("storage", "float64"),
+                      logodds_resolution=sensor_model.get("logodds_resolution", 0.05),
+                      logodds_min=sensor_model.get("logodds_min"),
+                      logodds_max=sensor_model.get("logodds_max"),
+                      scan_preprocessor=ScanPreprocessor(
+                          decimation=mapping_params.get("decimation", 1),
+                          deduplicate=mapping_params.get("deduplicate", False),
+                          max_range_free=mapping_params.get("max_range_free", True)),
+                      jit=mapping_params.get("jit", True),
+                      decay_half_life=sensor_model.get("decay_half_life"))
+    if map_params.get("backend", "dense") == "tiled":
+        map_class, map_kwargs["tile_size"] = TiledOGMap, map_params.get("tile_size", 64)
+    else:
+        map_class = OGMap
+    occ_grid_map = map_class(map_params["height"], map_params["width"], map_params["resolution"],
+                             map_params["origin"], sensor_model["tau"], sensor_model["r_prob"],
+                             sensor_model["below_r_prob"], **map_kwargs)
+
+    # the whole recording is known in advance, so all poses fit into the buffer
+    poses = sorted(poses)
+    pose_buffer = PoseBuffer(max(len(poses), 1))
+    for pose in poses:
+        pose_buffer.add(*pose)
+    tolerance = mapping_params.get("pose_tolerance", 0.05)
+    deskew = mapping_params.get("deskew", False)
+
+    integrated = 0
+    start = time.perf_counter()
+    for scan in sorted(scans, key=lambda scan: scan.stamp):
+        pose = pose_buffer.lookup(scan.stamp, tolerance)
+        if pose is None:
+            continue
+
+        ray_poses = None
+        if deskew and scan.time_increment > 0:
+            ray_poses = deskew_poses(pose_buffer, scan.stamp, len(scan.ranges), scan.time_increment,
+                                     laser_offset, tolerance)
+        if ray_poses is not None:
+            laser_pose, laser_yaw = ray_poses[:2], ray_poses[2]
+        else:
+            laser_pose = [pose[0] + np.cos(pose[2]) * laser_offset, pose[1] + np.sin(pose[2]) * laser_offset]
+            laser_yaw = pose[2]
+
+        occ_grid_map.updatemap(scan.ranges, scan.angle_min, scan.angle_max, scan.angle_increment,
+                               scan.range_min, scan.range_max, laser_pose, laser_yaw, scan.stamp)
+        integrated += 1
+
+    return occ_grid_map, integrated, time.perf_counter() - start
+
+
+def main():
+    """
+    reads the recording given on the command line, maps it and writes the map
+    """
+    parser = argparse.ArgumentParser(description="Build an occupancy grid map from recorded LaserScan "
+                                                 "and Odometry messages, without a ROS master.")
+    parser.add_argument("--bag", help="rosbag holding the LaserScan and Odometry messages")
+    parser.add_argument("--scan-topic", default="/laser_scan", help="LaserScan topic in the rosbag")
+    parser.add_argument("--odometry-topic", default="/ground_truth", help="Odometry topic in the rosbag")
+    parser.add_argument("--scans", help="LaserScan messages recorded with rostopic echo")
+    parser.add_argument("--odometry", help="Odometry messages recorded with rostopic echo")
+    parser.add_argument("--config-dir", default=CONFIG_DIR, help="directory of the yaml configuration files")
+    parser.add_argument("-o", "--output", default="map.yaml", help="map yaml file to write, "
+                                                                   "the pgm image is written next to it")
+    parser.add_argument("--save-logodds", action="store_true", help="also write the logodds to an npz file "
+                                                                    "next to the map, to resume mapping from it")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.bag:
+        poses, scans = read_bag(args.bag, args.scan_topic, args.odometry_topic)
+    elif args.scans and args.odometry:
+        poses = [pose_from_dict(message) for message in read_echo_file(args.odometry)]
+        scans = [scan_from_dict(message) for message in read_echo_file(args.scans)]
+    else:
+        parser.error("either --bag or both --scans and --odometry are required")
+    read_time = time.perf_counter() - start
+
+    occ_grid_map, integrated, mapping_time = build_map(poses, scans, args.config_dir)
+    occ_grid_map.saveMap(args.output, save_logodds=args.save_logodds)
+
+    print(f"read {len(scans)} scans and {len(poses)} poses in {read_time:.2f} s")
+    print(f"integrated {integrated} scans in {mapping_time:.2f} s "
+          f"({integrated / mapping_time if mapping_time > 0 else float('inf'):.1f} scans/s)")
+    print(f"ray casting engine: {occ_grid_map.engine}")
+    print(occ_grid_map.scan_preprocessor.summary())
+    print(f"map written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+Fixed-size ring buffer of stamped planar robot poses, used to look up
+the pose of the robot at the time stamp of a laser scan.
+"""
+
+import numpy as np
+
+
+def wrap_angle(angle):
+    """
+    wraps angles into [-pi, pi)
+    @param: angle - angle or array of angles [rad]
+    @result: returns the wrapped angle(s)
+    """
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+class PoseBuffer:
+    """
+    Ring buffer of stamped poses held in preallocated arrays
+    @input: poses (stamp, x, y, yaw) in chronological order
+    @output: pose interpolated at any stamp covered by the buffer
+    """
+    def __init__(self, capacity):
+        """
+        class initialization
+        @param: self
+        @param: capacity - maximum number of poses kept, the oldest
+                pose is overwritten once the buffer is full
+        @result: empty buffer
+        """
+        self.capacity = capacity
+        self.stamps = np.zeros(capacity)
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.yaw = np.zeros(capacity)
+
+        # number of stored poses and position of the next write
+        self.size = 0
+        self.head = 0
+
+    def add(self, stamp, x, y, yaw):
+        """
+        Stores a new pose, poses older than the newest stored one are discarded
+        @param: stamp - time stamp of the pose [s]
+        @param: x, y, yaw - planar pose [m, m, rad]
+        @result: returns True if the pose has been stored
+        """
+        if self.size and stamp <= self.newest():
+            return False
+
+        self.stamps[self.head] = stamp
+        self.x[self.head] = x
+        self.y[self.head] = y
+        self.yaw[self.head] = yaw
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return True
+
+    def clear(self):
+        """
+        Removes all poses, e.g. after the clock jumped back
+        """
+        self.size = 0
+        self.head = 0
+
+    def _index(self, k):
+        """
+        Returns the array index of the k-th oldest stored pose
+        """
+        return (self.head - self.size + k) % self.capacity
+
+    def oldest(self):
+        """
+        Returns the stamp of the oldest stored pose
+        """
+        return self.stamps[self._index(0)]
+
+    def newest(self):
+        """
+        Returns the stamp of the newest stored pose
+        """
+        return self.stamps[self._index(self.size - 1)]
+
+    def lookup(self, stamp, tolerance=0.0):
+        """
+        Interpolates the pose at the given stamp in O(log n)
+        @param: stamp - time stamp to look up [s]
+        @param: tolerance - stamps at most this far outside of the buffered
+                time span get the oldest or newest pose [s]
+        @result: returns the interpolated pose (x, y, yaw), None if the
+                 stamp is not covered by the buffer
+        """
+        if not self.size:
+            return None
+
+        oldest = self._index(0)
+        newest = self._index(self.size - 1)
+        if stamp <= self.stamps[oldest]:
+            if self.stamps[oldest] - stamp > tolerance:
+                return None
+            return self.x[oldest], self.y[oldest], self.yaw[oldest]
+        if stamp >= self.stamps[newest]:
+            if stamp - self.stamps[newest] > tolerance:
+                return None
+            return self.x[newest], self.y[newest], self.yaw[newest]
+
+        # binary search for the first pose newer than the stamp
+        low, high = 1, self.size - 1
+        while low < high:
+            middle = (low + high) // 2
+            if self.stamps[self._index(middle)] > stamp:
+                high = middle
+            else:
+                low = middle + 1
+        before = self._index(low - 1)
+        after = self._index(low)
+
+        # linear interpolation, along the shortest arc for the yaw angle
+        alpha = (stamp - self.stamps[before]) / (self.stamps[after] - self.stamps[before])
+        x = self.x[before] + alpha * (self.x[after] - self.x[before])
+        y = self.y[before] + alpha * (self.y[after] - self.y[before])
+        yaw = wrap_angle(self.yaw[before] + alpha * wrap_angle(self.yaw[after] - self.yaw[before]))
+        return x, y, yaw
+
+    def lookup_many(self, stamps, tolerance=0.0):
+        """
+        Interpolates the poses at an array of stamps in one vectorized pass
+        @param: stamps - array of time stamps to look up [s]
+        @param: tolerance - stamps at most this far outside of the buffered
+                time span get the oldest or newest pose [s]
+        @result: returns the arrays (x, y, yaw) of interpolated poses and
+                 a mask which is False for the stamps not covered by the buffer
+        """
+        stamps = np.asarray(stamps, dtype=float)
+        if not self.size:
+            nan = np.full(stamps.shape, np.nan)
+            return nan, nan.copy(), nan.copy(), np.zeros(stamps.shape, dtype=bool)
+
+        # stored poses in chronological order
+        order = self._index(np.arange(self.size))
+        pose_stamps = self.stamps[order]
+        valid = ((stamps >= pose_stamps[0] - tolerance) & (stamps <= pose_stamps[-1] + tolerance))
+
+        # pair of stored poses around every stamp, clamped to the buffered time span
+        after = np.clip(np.searchsorted(pose_stamps, stamps, side='right'), 1, max(self.size - 1, 1))
+        before = after - 1
+        after = np.minimum(after, self.size - 1)
+        span = pose_stamps[after] - pose_stamps[before]
+        alpha = np.clip(np.divide(stamps - pose_stamps[before], span,
+                                  out=np.zeros(stamps.shape), where=span > 0), 0.0, 1.0)
+
+        # linear interpolation, along the shortest arc for the yaw angle
+        before, after = order[before], order[after]
+        x = self.x[before] + alpha * (self.x[after] - self.x[before])
+        y = self.y[before] + alpha * (self.y[after] - self.y[before])
+        yaw = wrap_angle(self.yaw[before] + alpha * wrap_angle(self.yaw[after] - self.yaw[before]))
+        return x, y, yaw, valid
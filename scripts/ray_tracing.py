@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Ray tracing of laser scans into grid cells, in the mapping process or
+split across a pool of worker processes which exchange the rays and the
+traced cells through shared memory, or fused with the logodds update of
+the crossed cells into one compiled kernel when numba is installed.
+"""
+
+import numpy as np
+
+from bresenham import bresenham_batch
+
+
+def trace_rays(start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit=None):
+    """
+    Resolves laser rays into the cells they cross, ray by ray
+    @param: start_x, start_y - cells of the laser scanner
+    @param: minus_x, minus_y - cells of the ray ends at (range - tau/2)
+    @param: plus_x, plus_y - cells of the ray ends at (range + tau/2)
+    @param: hit - mask of the rays which hit an obstacle, the cells up to
+            (plus_x, plus_y) of the other rays are all free, None if all rays hit
+    @result: returns the arrays (x, y) of the crossed cells and a mask of the
+             free cells, every ray lists its free cells then its occupied cells
+    """
+    # non-occupied cells, without the last one of each ray as it is also listed as an occupied cell
+    free_x, free_y, free_offsets = bresenham_batch(start_x, start_y, minus_x, minus_y)
+    keep = np.ones(free_x.size, dtype=bool)
+    keep[free_offsets[1:] - 1] = False
+    free_x, free_y = free_x[keep], free_y[keep]
+    free_lengths = np.diff(free_offsets) - 1
+
+    # occupied cells
+    occ_x, occ_y, occ_offsets = bresenham_batch(minus_x, minus_y, plus_x, plus_y)
+    return interleave_sections(free_x, free_y, free_lengths, occ_x, occ_y, occ_offsets, hit)
+
+
+def interleave_sections(free_x, free_y, free_lengths, occ_x, occ_y, occ_offsets, hit=None):
+    """
+    Merges the free and the occupied sections of the rays into one list of cells
+    @param: free_x, free_y, free_lengths - free cells of all rays and their number per ray
+    @param: occ_x, occ_y, occ_offsets - occupied cells of all rays and the offsets of every ray
+    @param: hit - mask of the rays which hit an obstacle, None if all rays hit
+    @result: returns the arrays (x, y) of the cells and a mask of the free cells
+    """
+    occ_lengths = np.diff(occ_offsets)
+
+    # interleave both sections ray by ray, so that every cell
+    # receives its observations in the order of the laser scan
+    seg_lengths = np.stack([free_lengths, occ_lengths], axis=1).ravel()
+    seg_starts = np.stack([np.cumsum(free_lengths) - free_lengths,
+                           free_x.size + occ_offsets[:-1]], axis=1).ravel()
+    seg_offsets = np.cumsum(seg_lengths) - seg_lengths
+    order = np.repeat(seg_starts - seg_offsets, seg_lengths) + np.arange(seg_lengths.sum())
+
+    cells_x = np.concatenate([free_x, occ_x])[order]
+    cells_y = np.concatenate([free_y, occ_y])[order]
+    if hit is None:
+        return cells_x, cells_y, order < free_x.size
+    cells_free = np.concatenate([np.ones(free_x.size, dtype=bool), np.repeat(~hit, occ_lengths)])[order]
+    return cells_x, cells_y, cells_free
+
+
+def ray_lengths(start_x, start_y, minus_x, minus_y, plus_x, plus_y):
+    """
+    Returns the number of cells trace_rays lists for every ray, without tracing them
+    """
+    free = np.maximum(np.abs(minus_x - start_x), np.abs(minus_y - start_y))
+    occupied = np.maximum(np.abs(plus_x - minus_x), np.abs(plus_y - minus_y)) + 1
+    return free + occupied
+
+
+class RayTable:
+    """
+    Cells crossed by rays leaving a cell in a fixed set of quantized directions,
+    so that the rays of a scan are traced by looking up and offsetting the cells
+    of the closest direction instead of running the line algorithm
+    @input: directions and ends of the rays
+    @output: crossed cells, the free ones approximated to the quantized directions
+    """
+    def __init__(self, bins, max_range, resolution):
+        """
+        class initialization
+        @param: self
+        @param: bins - number of quantized directions over the full circle
+        @param: max_range - longest ray of the table [m]
+        @param: resolution - size of a grid cell [m]
+        @result: table of the cell offsets along every direction
+        """
+        self.bins = bins
+        self.max_range = max_range
+        self.resolution = resolution
+
+        # every direction ends after the same number of steps along its major axis
+        self.steps = int(np.ceil(max_range / resolution)) + 2
+        angles = 2 * np.pi * np.arange(bins) / bins
+        cos_angles, sin_angles = np.cos(angles), np.sin(angles)
+        major = np.maximum(np.abs(cos_angles), np.abs(sin_angles))
+        end_x = np.rint(self.steps * cos_angles / major).astype(int)
+        end_y = np.rint(self.steps * sin_angles / major).astype(int)
+        offset_x, offset_y, _ = bresenham_batch(np.zeros(bins, dtype=int), np.zeros(bins, dtype=int), end_x, end_y)
+        self.offset_x = offset_x.reshape(bins, self.steps + 1)
+        self.offset_y = offset_y.reshape(bins, self.steps + 1)
+
+    def trace(self, theta, start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit=None):
+        """
+        Resolves laser rays into the cells they cross, same result layout as trace_rays
+        @param: theta - direction of every ray [rad]
+        @param: other parameters as for trace_rays, the ends of the rays
+                only give the number of cells looked up for every ray
+        @result: returns the arrays (x, y) of the crossed cells and a mask of the free cells
+        """
+        direction = np.rint(theta * (self.bins / (2 * np.pi))).astype(int) % self.bins
+
+        # free cells looked up, as many as the line algorithm steps along the major axis
+        free_lengths = np.minimum(np.maximum(np.abs(minus_x - start_x), np.abs(minus_y - start_y)), self.steps)
+        offsets = np.cumsum(free_lengths) - free_lengths
+        rays = np.repeat(np.arange(free_lengths.size), free_lengths)
+        steps = np.arange(free_lengths.sum()) - offsets[rays]
+        free_x = start_x[rays] + self.offset_x[direction[rays], steps]
+        free_y = start_y[rays] + self.offset_y[direction[rays], steps]
+
+        # the few occupied cells are traced exactly
+        occ_x, occ_y, occ_offsets = bresenham_batch(minus_x, minus_y, plus_x, plus_y)
+        return interleave_sections(free_x, free_y, free_lengths, occ_x, occ_y, occ_offsets, hit)
+
+
+def integrate_rays(logodds_map, observed, start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit,
+                   odds_free, odds_occupied, clamp, logodds_min, logodds_max, stamps, stamp, half_life):
+    """
+    Traces the laser rays and adds their observations to the crossed cells in
+    one pass, cell for cell and in the same order as trace_rays followed by
+    the logodds update of the map. Plain Python is far too slow for a scan,
+    this function is meant to be compiled by compiled_ray_kernel
+    @param: logodds_map - 2D float array of logodds, updated in place
+    @param: observed - 2D mask of the cells observed at least once, updated in place
+    @param: start_x ... plus_y, hit - rays as for trace_rays, all cells must lie within the map
+    @param: odds_free, odds_occupied - logodds increments of free and occupied cells
+    @param: clamp - whether the logodds of the crossed cells are clamped after the scan
+    @param: logodds_min, logodds_max - clamping bounds
+    @param: stamps - 2D array of the stamps of the last update of every cell, updated in place
+    @param: stamp - time of the scan, the crossed cells are decayed to it before their update
+    @param: half_life - half-life of the decay of the logodds, 0 for no decay
+    @result: returns the number of updated cells and the inclusive bounding
+             box (x_min, y_min, x_max, y_max) of the crossed cells
+    """
+    n_cells = 0
+    x_min, y_min = logodds_map.shape[1], logodds_map.shape[0]
+    x_max, y_max = -1, -1
+
+    # the second pass walks the rays again to clamp the logodds once all observations are added
+    for clamping in range(2 if clamp else 1):
+        for ray in range(start_x.size):
+            # first the free section without its last cell, then the occupied section
+            for section in range(2):
+                if section == 0:
+                    x0, y0, x1, y1 = start_x[ray], start_y[ray], minus_x[ray], minus_y[ray]
+                    odds = odds_free
+                else:
+                    x0, y0, x1, y1 = minus_x[ray], minus_y[ray], plus_x[ray], plus_y[ray]
+                    odds = odds_occupied if hit[ray] else odds_free
+
+                # same stepping as bresenham_batch
+                is_steep = abs(y1 - y0) > abs(x1 - x0)
+                if is_steep:
+                    x0, y0, x1, y1 = y0, x0, y1, x1
+                swapped = x0 > x1
+                if swapped:
+                    x0, y0, x1, y1 = x1, y1, x0, y0
+                da = x1 - x0
+                db = abs(y1 - y0)
+                bstep = 1 if y0 < y1 else -1
+                error = da // 2
+
+                for step in range(da if section == 0 else da + 1):
+                    k = da - step if swapped else step
+                    increments = (k * db - error + da - 1) // da if da > 0 else 0
+                    a = x0 + k
+                    b = y0 + bstep * increments
+                    x, y = (b, a) if is_steep else (a, b)
+
+                    if clamping:
+                        logodds_map[y, x] = min(max(logodds_map[y, x], logodds_min), logodds_max)
+                        continue
+                    if half_life > 0 and stamps[y, x] != stamp:
+                        # first crossing of the cell in this scan
+                        logodds_map[y, x] *= np.exp2(-max(stamp - stamps[y, x], 0.0) / half_life)
+                        stamps[y, x] = stamp
+                    logodds_map[y, x] += odds
+                    observed[y, x] = True
+                    n_cells += 1
+                    x_min, x_max = min(x_min, x), max(x_max, x)
+                    y_min, y_max = min(y_min, y), max(y_max, y)
+
+    return n_cells, x_min, y_min, x_max, y_max
+
+
+# integrate_rays compiled by numba, False if numba is not installed
+_compiled_kernel = None
+
+
+def compiled_ray_kernel():
+    """
+    Returns integrate_rays compiled by numba, None if numba is not installed.
+    The kernel is compiled once per process, for C-contiguous float64 maps
+    """
+    global _compiled_kernel
+    if _compiled_kernel is None:
+        try:
+            import numba
+        except ImportError:
+            _compiled_kernel = False
+            return None
+        kernel = numba.njit(cache=True, nogil=True)(integrate_rays)
+        # compiled now rather than on the first scan
+        rays = np.zeros(1, dtype=np.int64)
+        kernel(np.zeros((1, 1)), np.zeros((1, 1), dtype=bool), *[rays] * 6, np.ones(1, dtype=bool),
+               0.0, 0.0, False, 0.0, 0.0, np.zeros((1, 1)), 0.0, 0.0)
+        _compiled_kernel = kernel
+    return _compiled_kernel or None
+
+
+# shared memory blocks attached by a worker process, by role
+_attached = {}
+
+
+def _attach(role, name):
+    """
+    Returns the shared memory block of a role, attaching it in the worker
+    process if it has been replaced since the last task
+    """
+    from multiprocessing import shared_memory
+
+    block = _attached.get(role)
+    if block is None or block.name != name:
+        if block is not None:
+            block.close()
+        block = _attached[role] = shared_memory.SharedMemory(name=name)
+    return block
+
+
+def _trace_chunk(task):
+    """
+    Worker task tracing a contiguous chunk of rays into the shared cell buffers
+    @param: task - shared memory names and capacities, chunk bounds of the
+            rays and offset of the first cell of the chunk
+    """
+    rays_name, rays_capacity, cells_name, cells_capacity, first_ray, last_ray, first_cell = task
+    rays = np.ndarray((7, rays_capacity), dtype=np.int64, buffer=_attach("rays", rays_name).buf)
+    cells = np.ndarray((3, cells_capacity), dtype=np.int64, buffer=_attach("cells", cells_name).buf)
+
+    chunk = rays[:, first_ray:last_ray]
+    x, y, free = trace_rays(*chunk[:6], hit=chunk[6].astype(bool))
+    cells[0, first_cell:first_cell + x.size] = x
+    cells[1, first_cell:first_cell + x.size] = y
+    cells[2, first_cell:first_cell + x.size] = free
+
+
+class ParallelRayTracer:
+    """
+    Pool of worker processes tracing the rays of a scan in contiguous chunks.
+    Every chunk is written at its offset in the shared cell buffer, so the
+    cells come out in the same order as with trace_rays in one process
+    @input: rays of a laser scan in grid cells
+    @output: crossed cells in the order of the rays
+    """
+    def __init__(self, workers):
+        """
+        class initialization
+        @param: self
+        @param: workers - number of worker processes
+        @result: started worker processes, the shared buffers are
+                 allocated with the first scan
+        """
+        # multiprocessing is only imported when the rays are traced in parallel
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self.shared_memory = shared_memory
+
+        self.workers = workers
+        # the workers are forked from a clean server process, not from the node and its threads
+        self.pool = multiprocessing.get_context("forkserver").Pool(workers)
+        self.rays = None
+        self.cells = None
+
+    def _buffer(self, block, rows, capacity):
+        """
+        Returns a shared memory block of at least the given capacity, growing it if needed
+        """
+        if block is not None and block.size >= rows * capacity * 8:
+            return block
+        if block is not None:
+            block.close()
+            block.unlink()
+        # grown geometrically so that the buffers are rarely replaced
+        return self.shared_memory.SharedMemory(create=True, size=rows * max(capacity, 1024) * 8 * 2)
+
+    def trace(self, start_x, start_y, minus_x, minus_y, plus_x, plus_y, hit=None):
+        """
+        Traces the rays in the worker processes, same arguments and result as trace_rays
+        """
+        lengths = ray_lengths(start_x, start_y, minus_x, minus_y, plus_x, plus_y)
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        n_rays, n_cells = lengths.size, int(offsets[-1])
+
+        self.rays = self._buffer(self.rays, 7, n_rays)
+        self.cells = self._buffer(self.cells, 3, n_cells)
+        rays_capacity = self.rays.size // (7 * 8)
+        cells_capacity = self.cells.size // (3 * 8)
+        rays = np.ndarray((7, rays_capacity), dtype=np.int64, buffer=self.rays.buf)
+        rays[:, :n_rays] = (start_x, start_y, minus_x, minus_y, plus_x, plus_y,
+                            np.ones(n_rays, dtype=bool) if hit is None else hit)
+
+        # chunks of about the same number of cells
+        bounds = np.searchsorted(offsets, np.linspace(0, n_cells, self.workers + 1)[1:-1])
+        bounds = np.concatenate([[0], bounds, [n_rays]])
+        tasks = [(self.rays.name, rays_capacity, self.cells.name, cells_capacity,
+                  int(first), int(last), int(offsets[first]))
+                 for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+        self.pool.map(_trace_chunk, tasks)
+
+        cells = np.ndarray((3, cells_capacity), dtype=np.int64, buffer=self.cells.buf)
+        return cells[0, :n_cells].copy(), cells[1, :n_cells].copy(), cells[2, :n_cells].astype(bool)
+
+    def close(self):
+        """
+        Stops the worker processes and releases the shared buffers
+        """
+        self.pool.terminate()
+        self.pool.join()
+        for block in (self.rays, self.cells):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.rays = self.cells = None
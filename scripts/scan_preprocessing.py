@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Preprocessing of the laser scans before their integration into the map:
+range masking, angular decimation and deduplication of the beams
+ending in the same grid cell, with counters of the beams it saved.
+"""
+
+import numpy as np
+
+
+class ScanPreprocessor:
+    """
+    Selects the beams of a laser scan worth tracing
+    @input: laser ranges and laser metadata (min / max ranges)
+    @output: indices and ranges of the kept beams, and whether they hit an obstacle
+    """
+    def __init__(self, decimation=1, deduplicate=False, max_range_free=True):
+        """
+        class initialization
+        @param: self
+        @param: decimation - only every n-th beam of a scan is kept
+        @param: deduplicate - only the first of the beams whose end lies
+                in the same grid cell is kept
+        @param: max_range_free - beams without return (inf or nan range) are
+                traced as free space up to the max range, or the map border,
+                instead of discarded
+        @result: preprocessor with zeroed counters
+        """
+        self.decimation = max(int(decimation), 1)
+        self.deduplicate = deduplicate
+        self.max_range_free = max_range_free
+
+        ### counters of the beams, over all scans ###
+        self.beams = 0
+        self.beams_out_of_range = 0
+        self.beams_max_range = 0
+        self.beams_decimated = 0
+        self.beams_deduplicated = 0
+
+    def select(self, ranges, range_min, range_max):
+        """
+        Masks and decimates the beams of a scan
+        @param: ranges - array of laser ranges
+        @param: range_min, range_max - min and max distances at which the laser range finder can detect an obstacle
+        @result: returns the indices of the kept beams, their ranges with the
+                 max range for the beams without return, and a mask of the beams
+                 which hit an obstacle
+        """
+        self.beams += ranges.size
+
+        # beams without return, if they are traced as free space
+        no_return = np.isnan(ranges) | (ranges == np.inf)
+        if not self.max_range_free:
+            no_return[:] = False
+        in_range = (ranges >= range_min) & (ranges <= range_max)
+        keep = in_range | no_return
+        self.beams_out_of_range += ranges.size - np.count_nonzero(keep)
+
+        # angular decimation
+        if self.decimation > 1:
+            decimated = keep.copy()
+            decimated[np.arange(ranges.size) % self.decimation != 0] = False
+            self.beams_decimated += np.count_nonzero(keep) - np.count_nonzero(decimated)
+            keep = decimated
+
+        idx_range = np.flatnonzero(keep)
+        hit = ~no_return[idx_range]
+        return idx_range, np.where(hit, ranges[idx_range], range_max), hit
+
+    def unique(self, x, y, hit):
+        """
+        Finds the first beam of every group of beams ending in the same grid
+        cell, among the beams which lie within the map
+        @param: x, y - index arrays of the cells the beams end in
+        @param: hit - mask of the beams which hit an obstacle, beams with and
+                without hit are not merged
+        @result: returns the mask of the beams to trace, the beams without
+                 return are counted once they are traced
+        """
+        keep = np.ones(x.size, dtype=bool)
+        if self.deduplicate and x.size > 0:
+            x_min, y_min = x.min(), y.min()
+            keys = ((y - y_min) * (x.max() - x_min + 1) + (x - x_min)) * 2 + hit
+            keep[:] = False
+            keep[np.unique(keys, return_index=True)[1]] = True
+            self.beams_deduplicated += x.size - np.count_nonzero(keep)
+
+        self.beams_max_range += np.count_nonzero(keep & ~hit)
+        return keep
+
+    def summary(self):
+        """
+        Returns the counters as text for the logs
+        """
+        return (f"beams: {self.beams}, out of range: {self.beams_out_of_range}, "
+                f"max range: {self.beams_max_range}, decimated: {self.beams_decimated}, "
+                f"deduplicated: {self.beams_deduplicated}")
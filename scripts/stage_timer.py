@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Low-overhead instrumentation of the mapping stages: durations and other
+per-scan values are kept in fixed-size rolling windows from which the
+percentiles are computed on demand, and can be traced to a CSV file.
+"""
+
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+
+class StageTimer:
+    """
+    Rolling windows of the values measured for every stage
+    @input: durations and values of the stages, as they happen
+    @output: rolling percentiles of every stage, optional CSV trace
+    """
+    def __init__(self, window=1000, csv_path=None):
+        """
+        class initialization
+        @param: self
+        @param: window - number of latest values kept per stage
+        @param: csv_path - file every measured value is appended to as
+                "time,stage,value", None for no trace
+        @result: empty windows
+        """
+        self.window = window
+        # stage -> [values, number of values recorded so far]
+        self.stages = {}
+        # stage -> unit of its values
+        self.units = {}
+
+        self.csv_file = None
+        self.csv_lock = threading.Lock()
+        if csv_path:
+            self.csv_file = open(csv_path, "a", buffering=1)
+            if self.csv_file.tell() == 0:
+                self.csv_file.write("time,stage,value\n")
+
+    def record(self, stage, value, unit="s"):
+        """
+        Adds a value to the window of a stage
+        @param: stage - name of the stage
+        @param: value - duration or any other per-scan value of the stage
+        @param: unit - unit of the values of the stage, seconds for durations
+        """
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [np.zeros(self.window), 0]
+            self.units[stage] = unit
+        entry[0][entry[1] % self.window] = value
+        entry[1] += 1
+
+        with self.csv_lock:
+            if self.csv_file is not None:
+                self.csv_file.write(f"{time.time():.6f},{stage},{value:.9g}\n")
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """
+        Records the duration of the enclosed block as a value of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def percentiles(self, stage, q=(50, 95, 99)):
+        """
+        Returns the percentiles of the latest values of a stage
+        @param: stage - name of the stage
+        @param: q - percentiles to compute
+        @result: returns the array of percentiles, None if nothing has been recorded
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry[1] == 0:
+            return None
+        return np.percentile(entry[0][:min(entry[1], self.window)], q)
+
+    def count(self, stage):
+        """
+        Returns the number of values recorded for a stage since the start
+        """
+        entry = self.stages.get(stage)
+        return 0 if entry is None else entry[1]
+
+    def report(self):
+        """
+        Returns the rolling percentiles of every stage as text
+        @result: returns the list of ("<stage> p50/p95/p99 [<unit>]", "<p50> / <p95> / <p99>")
+                 pairs sorted by stage, with the durations in milliseconds
+        """
+        report = []
+        for stage in sorted(self.stages):
+            p50, p95, p99 = self.percentiles(stage)
+            unit = self.units[stage]
+            if unit == "s":
+                # durations in milliseconds
+                p50, p95, p99, unit = 1e3 * p50, 1e3 * p95, 1e3 * p99, "ms"
+            report.append((f"{stage} p50/p95/p99 [{unit}]", f"{p50:.3f} / {p95:.3f} / {p99:.3f}"))
+        return report
+
+    def close(self):
+        """
+        Closes the CSV trace
+        """
+        with self.csv_lock:
+            if self.csv_file is not None:
+                self.csv_file.close()
+                self.csv_file = None
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Regression tests checking that the batch ray traversal in bresenham.py
+produces the same cells, in the same order, as the reference bresenham()
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from bresenham import bresenham, bresenham_batch
+
+
+def split_lines(x, y, offsets):
+    """
+    split the concatenated output of bresenham_batch() into one list of
+    coordinate tuples per line
+    """
+    return [list(zip(x[start:end].tolist(), y[start:end].tolist()))
+            for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def test_batch_matches_reference_on_random_lines():
+    rng = np.random.default_rng(42)
+    x0, y0, x1, y1 = rng.integers(-50, 50, size=(4, 5000))
+
+    lines = split_lines(*bresenham_batch(x0, y0, x1, y1))
+
+    for k, line in enumerate(lines):
+        assert line == bresenham(int(x0[k]), int(y0[k]), int(x1[k]), int(y1[k]))
+
+
+def test_batch_matches_reference_in_all_octants():
+    # lines from a common start cell to every cell of a square around it
+    # covering the steep, flat, diagonal and swapped cases
+    x1, y1 = np.meshgrid(np.arange(-7, 8), np.arange(-7, 8))
+    x1, y1 = x1.ravel(), y1.ravel()
+
+    lines = split_lines(*bresenham_batch(3, -2, x1, y1))
+
+    for k, line in enumerate(lines):
+        assert line == bresenham(3, -2, int(x1[k]), int(y1[k]))
+
+
+def test_batch_offsets():
+    x, y, offsets = bresenham_batch([0, 5], [0, 5], [4, 5], [1, 5])
+
+    assert offsets.tolist() == [0, 5, 6]
+    assert x.size == y.size == offsets[-1]
+
+
+def test_batch_empty():
+    x, y, offsets = bresenham_batch([], [], [], [])
+
+    assert x.size == 0 and y.size == 0
+    assert offsets.tolist() == [0]
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the ROS-free map core in occupancy_map.py, which has to be
+importable and usable without any ROS package installed
+"""
+
+import multiprocessing
+import os
+import sys
+from xml.etree import ElementTree
+
+import numpy as np
+import pytest
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from occupancy_map import DistanceField, FrontierDetector, OGMap, TiledOGMap, footprint_radii, obstacle_distances
+from ray_tracing import integrate_rays, trace_rays
+from scan_preprocessing import ScanPreprocessor
+
+# 30 m x 30 m map with 0.1 m cells and the sensor model of data/config
+MAP_ARGS = (30, 30, 0.1, [-15, -5], 0.05, 0.8, 0.2)
+# half circle scan of 720 beams like the S300
+SCAN_ARGS = (-1.5708, 1.5708, 0.004369401838630438, 0.1, 8.0)
+
+
+def random_scans(n_scans, seed=0):
+    """
+    yields (ranges, laser position, yaw) of scans taken well inside the map
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(n_scans):
+        yield rng.uniform(0.05, 10.0, 720), [rng.uniform(-6, 6), rng.uniform(4, 16)], rng.uniform(-3, 3)
+
+
+def test_core_does_not_import_ros():
+    assert 'rospy' not in sys.modules
+
+
+def test_scan_marks_free_and_occupied_cells():
+    occ_grid_map = OGMap(*MAP_ARGS)
+    # a single beam straight ahead hitting an obstacle 2 m away
+    occ_grid_map.updatemap([2.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0)
+
+    occupancy = occ_grid_map.occupancy()
+    robot_x, robot_y = 150, 150
+    assert np.all(occupancy[robot_y, robot_x:robot_x + 19] < 50)
+    assert occupancy[robot_y, robot_x + 20] > 50
+    assert occupancy[robot_y + 1, robot_x] == -1
+
+
+def test_tiled_map_matches_dense_map():
+    dense = OGMap(*MAP_ARGS)
+    tiled = TiledOGMap(*MAP_ARGS, tile_size=48)
+    for ranges, position, yaw in random_scans(10):
+        dense.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        tiled.updatemap(ranges, *SCAN_ARGS, position, yaw)
+
+    assert np.array_equal(dense.occupancy(), tiled.occupancy(*dense.extent()))
+
+
+@pytest.mark.parametrize("map_class", [OGMap, TiledOGMap])
+def test_beam_without_return_clears_cells_up_to_the_map_border(map_class):
+    occ_grid_map = map_class(*MAP_ARGS, scan_preprocessor=ScanPreprocessor())
+    # a single beam without return straight ahead, with a max range beyond the 15 m to the map border
+    occ_grid_map.updatemap([np.inf], 0.0, 0.0, 0.0, 0.1, 30.0, [0.05, 10.05], 0.0)
+
+    occupancy = occ_grid_map.occupancy(150, 150, 299, 150)
+    assert np.all((occupancy >= 0) & (occupancy < 50))
+    assert occ_grid_map.scan_preprocessor.beams_max_range == 1
+
+
+def test_saved_map_seeds_an_identical_map(tmp_path):
+    occ_grid_map = OGMap(*MAP_ARGS, storage="int16")
+    for ranges, position, yaw in random_scans(5):
+        occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    # the directory of the map is created
+    occ_grid_map.saveMap(str(tmp_path / "maps" / "map.yaml"), save_logodds=True)
+
+    seeded = OGMap(*MAP_ARGS, storage="int16")
+    seeded.seedMap(str(tmp_path / "maps" / "map.yaml"))
+
+    assert np.array_equal(seeded.logodds_map, occ_grid_map.logodds_map)
+    assert np.array_equal(seeded.observed, occ_grid_map.observed)
+
+
+@pytest.mark.parametrize("storage", ["int16", "int8"])
+def test_fixed_point_logodds_saturate_at_the_storage_limits(storage):
+    occ_grid_map = OGMap(*MAP_ARGS, storage=storage)
+    limits = np.iinfo(storage)
+    assert (occ_grid_map.toStorage(1e6), occ_grid_map.toStorage(-1e6)) == (limits.max, limits.min)
+
+    # far more observations in one scan than the storage can count, summed up over
+    # the bounding box of a single cell and over two cells far apart
+    for x, y in (([170], [150]), ([10, 290], [10, 290])):
+        x, y = np.repeat(x, 2000), np.repeat(y, 2000)
+        occ_grid_map.cellsUpdate(x, y, np.full(x.size, occ_grid_map.odds_r_prob_update))
+        assert np.all(occ_grid_map.logodds_map[y, x] == limits.max)
+        occ_grid_map.cellsUpdate(np.tile(x, 2), np.tile(y, 2),
+                                 np.full(2 * x.size, occ_grid_map.odds_below_r_prob_update))
+        assert np.all(occ_grid_map.logodds_map[y, x] == limits.min)
+
+
+@pytest.mark.parametrize("storage", ["float64", "int16", "int8"])
+def test_clamped_logodds_flip_back_after_repeated_observations(storage):
+    occ_grid_map = OGMap(*MAP_ARGS, storage=storage, logodds_min=-6, logodds_max=6)
+    bounds = occ_grid_map.toStorage(-6), occ_grid_map.toStorage(6)
+
+    # repeated hits of an obstacle 2 m ahead, then repeated misses once it is gone
+    for _ in range(100):
+        occ_grid_map.updatemap([2.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0)
+    assert occ_grid_map.logodds_map[150, 170] == bounds[1]
+    assert occ_grid_map.logodds_map[150, 150:169].min() == bounds[0]
+    for _ in range(5):
+        occ_grid_map.updatemap([3.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0)
+    assert occ_grid_map.occupancy()[150, 170] < 50
+    for _ in range(100):
+        occ_grid_map.updatemap([3.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0)
+    assert occ_grid_map.logodds_map[150, 170] == bounds[0]
+    assert occ_grid_map.logodds_map[150, 150:180].min() == bounds[0]
+    assert occ_grid_map.logodds_map[150, 150:180].max() == bounds[0]
+
+
+@pytest.mark.parametrize("map_class", [OGMap, TiledOGMap])
+def test_close_releases_both_backends(map_class):
+    occ_grid_map = map_class(*MAP_ARGS)
+    ranges, position, yaw = next(random_scans(1))
+    occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    occ_grid_map.close()
+
+
+def test_taken_pyramid_levels_are_not_updated_afterwards():
+    occ_grid_map = OGMap(*MAP_ARGS, pyramid_levels=2)
+    scans = random_scans(2)
+    ranges, position, yaw = next(scans)
+    occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    levels = occ_grid_map.takePyramid()
+    taken = [grid.copy() for _, _, grid in levels]
+
+    ranges, position, yaw = next(scans)
+    occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    assert occ_grid_map.takePyramid() is not None
+    assert all(np.array_equal(grid, copy) for (_, _, grid), copy in zip(levels, taken))
+
+
+def test_map_files_are_resumed_within_their_session(tmp_path):
+    map_file = str(tmp_path / "map")
+    occ_grid_map = OGMap(*MAP_ARGS, map_file=map_file, map_session="launch-1")
+    ranges, position, yaw = next(random_scans(1))
+    occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    occ_grid_map.close()
+
+    respawned = OGMap(*MAP_ARGS, map_file=map_file, map_session="launch-1")
+    assert respawned.resumed
+    assert np.array_equal(respawned.logodds_map, occ_grid_map.logodds_map)
+    respawned.close()
+
+    relaunched = OGMap(*MAP_ARGS, map_file=map_file, map_session="launch-2")
+    assert not relaunched.resumed
+    assert not relaunched.observed.any()
+
+
+def test_unobserved_cells_decay_to_unknown():
+    occ_grid_map = OGMap(*MAP_ARGS, decay_half_life=2.0)
+    occ_grid_map.updatemap([2.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0, stamp=10.0)
+    logodds = occ_grid_map.logodds_map[150, 170]
+    assert occ_grid_map.occupancy()[150, 170] > 50
+
+    # decayed when read, the stored logodds stay untouched
+    occ_grid_map.setStamp(14.0)
+    assert np.isclose(occ_grid_map.prob_map[150, 170], 1 - 1 / (1 + np.exp(logodds / 4)))
+    assert occ_grid_map.logodds_map[150, 170] == logodds
+    occ_grid_map.setStamp(100.0)
+    assert occ_grid_map.occupancy()[150, 170] == 50
+
+    # decayed when updated again, before the new observation is added
+    occ_grid_map.updatemap([2.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0, stamp=100.0)
+    assert np.isclose(occ_grid_map.logodds_map[150, 170], logodds * 2.0 ** -45 + occ_grid_map.odds_r_prob)
+
+
+@pytest.mark.parametrize("map_class", [OGMap, TiledOGMap])
+def test_unobserved_cells_decay_to_unknown_while_their_tile_is_observed(map_class):
+    # fixed-point storage, whose rounding must not stall the decay of the untouched cells
+    occ_grid_map = map_class(*MAP_ARGS, storage="int16", decay_half_life=2.0)
+    occ_grid_map.updatemap([2.0], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0, stamp=0.0)
+    assert occ_grid_map.occupancy(170, 150, 170, 150)[0, 0] > 50
+
+    # 10 half-lives of scans at 40 Hz crossing cells next to the obstacle cell but not the cell
+    for stamp in np.arange(1, 801) / 40:
+        occ_grid_map.updatemap([1.5], 0.0, 0.0, 0.0, 0.1, 8.0, [0.05, 10.05], 0.0, stamp=stamp)
+    assert occ_grid_map.occupancy(170, 150, 170, 150)[0, 0] == 50
+
+
+def test_obstacle_distances_match_brute_force():
+    obstacles = np.random.default_rng(2).random((40, 50)) < 0.02
+    obstacle_y, obstacle_x = np.nonzero(obstacles)
+    cells_y, cells_x = np.mgrid[:40, :50]
+    expected = np.hypot(cells_x[..., None] - obstacle_x, cells_y[..., None] - obstacle_y).min(axis=-1)
+    expected[expected > 6] = np.inf
+
+    assert np.array_equal(obstacle_distances(obstacles, 6), expected.astype(np.float32))
+
+
+def test_footprint_covers_the_robot_base():
+    data = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+    with open(os.path.join(data, 'config', 'robot_parameters.yaml')) as parameters_file:
+        footprint = yaml.safe_load(parameters_file)['footprint']
+    base = ElementTree.parse(os.path.join(data, 'urdf', 'base', 'base.urdf.xacro')).getroot()
+    base_diam = float(next(element.get('value') for element in base.iter()
+                           if element.tag.endswith('property') and element.get('name') == 'base_diam'))
+
+    assert footprint_radii(footprint)[0] >= base_diam / 2
+    assert np.allclose(footprint_radii([[0.37, 0.29], [0.37, -0.29], [-0.37, -0.29], [-0.37, 0.29]]),
+                       (0.29, np.hypot(0.37, 0.29)))
+
+
+def test_incremental_costmap_matches_rebuilt_costmap():
+    occ_grid_map = OGMap(*MAP_ARGS, inscribed_radius=0.29, inflation_radius=0.8)
+    occ_grid_map.takeCostmap()
+    for ranges, position, yaw in random_scans(10):
+        occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        occ_grid_map.takeCostmapUpdate()
+
+    rebuilt = DistanceField(occ_grid_map, 0.29, 0.8)
+    rebuilt.update()
+    assert np.array_equal(occ_grid_map.distance_field.costs, rebuilt.costs)
+    assert set(np.unique(rebuilt.costs)) >= {-1, 0, 99, 100}
+
+
+def test_incremental_frontiers_match_rebuilt_frontiers():
+    occ_grid_map = OGMap(*MAP_ARGS, frontier_min_size=3)
+    for ranges, position, yaw in random_scans(10):
+        occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        frontiers = occ_grid_map.takeFrontiers(position)
+
+    rebuilt = FrontierDetector(occ_grid_map, 3)
+    rebuilt.update()
+    assert np.array_equal(occ_grid_map.frontier_detector.frontier, rebuilt.frontier)
+    assert occ_grid_map.takeFrontiers() is None
+
+    # ranked by the distance of their goal to the robot, all above the minimum size
+    distances = [np.hypot(goal[0] - position[0], goal[1] - position[1]) for _, goal, _ in frontiers]
+    assert distances == sorted(distances)
+    assert min(size for _, _, size in frontiers) >= 3
+
+
+def test_consumers_built_for_a_snapshot_match_those_of_the_map():
+    consumers = dict(pyramid_levels=2, inscribed_radius=0.35, inflation_radius=0.8, frontier_min_size=3)
+    occ_grid_map = OGMap(*MAP_ARGS, **consumers)
+    # the consumers are only maintained for the snapshot, as in the node
+    plain = OGMap(*MAP_ARGS)
+    snapshot = None
+    for ranges, position, yaw in random_scans(10):
+        occ_grid_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        plain.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        if snapshot is None:
+            snapshot = plain.snapshot()
+            snapshot.buildConsumers(**consumers)
+        else:
+            snapshot = plain.snapshot(snapshot)
+        assert np.array_equal(snapshot.takeCostmap()[1], occ_grid_map.takeCostmap()[1])
+
+    assert len(plain.dirty_regions) == 1
+    assert all(np.array_equal(level[2], expected[2])
+               for level, expected in zip(snapshot.takePyramid(), occ_grid_map.takePyramid()))
+    assert [size for _, _, size in snapshot.takeFrontiers(position)] == \
+        [size for _, _, size in occ_grid_map.takeFrontiers(position)]
+
+
+def test_ray_kernel_matches_traced_cells():
+    # the kernel in plain Python, as numba compiles it
+    rng = np.random.default_rng(1)
+    rays = [rng.integers(0, 60, 20) for _ in range(6)]
+    hit = rng.random(20) < 0.7
+
+    logodds_map, observed = np.zeros((60, 60)), np.zeros((60, 60), dtype=bool)
+    n_cells, x_min, y_min, x_max, y_max = integrate_rays(logodds_map, observed, *rays, hit,
+                                                         -1.4, 1.4, True, -2.0, 2.0,
+                                                         np.zeros((1, 1)), 0.0, 0.0)
+
+    x, y, free = trace_rays(*rays, hit=hit)
+    expected, expected_observed = np.zeros((60, 60)), np.zeros((60, 60), dtype=bool)
+    np.add.at(expected, (y, x), np.where(free, -1.4, 1.4))
+    expected_observed[y, x] = True
+    assert n_cells == x.size
+    assert (x_min, y_min, x_max, y_max) == (x.min(), y.min(), x.max(), y.max())
+    assert np.array_equal(logodds_map, np.clip(expected, -2.0, 2.0))
+    assert np.array_equal(observed, expected_observed)
+
+
+@pytest.mark.skipif("forkserver" not in multiprocessing.get_all_start_methods(),
+                    reason="the worker processes are started by a forkserver")
+def test_parallel_ray_tracing_matches_single_process():
+    single = OGMap(*MAP_ARGS)
+    parallel = OGMap(*MAP_ARGS, workers=2)
+    try:
+        for ranges, position, yaw in random_scans(5):
+            single.updatemap(ranges, *SCAN_ARGS, position, yaw)
+            parallel.updatemap(ranges, *SCAN_ARGS, position, yaw)
+    finally:
+        parallel.close()
+
+    assert np.array_equal(single.logodds_map, parallel.logodds_map)
+    assert np.array_equal(single.observed, parallel.observed)
+    assert single.dirty_region.take() == parallel.dirty_region.take()
+
+
+def test_compiled_kernel_matches_numpy_engine():
+    pytest.importorskip("numba")
+    numpy_map = OGMap(*MAP_ARGS, logodds_min=-2.0, logodds_max=3.5)
+    numba_map = OGMap(*MAP_ARGS, logodds_min=-2.0, logodds_max=3.5, jit=True)
+    assert numba_map.engine == "numba kernel"
+    for ranges, position, yaw in random_scans(10):
+        numpy_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+        numba_map.updatemap(ranges, *SCAN_ARGS, position, yaw)
+
+    assert np.array_equal(numpy_map.logodds_map, numba_map.logodds_map)
+    assert np.array_equal(numpy_map.observed, numba_map.observed)
+    assert numpy_map.dirty_region.take() == numba_map.dirty_region.take()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the pose lookup at the laser scan stamps in pose_buffer.py
+and of the per-ray laser poses of a deskewed scan in deskew.py
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from deskew import deskew_poses
+from pose_buffer import PoseBuffer
+
+
+def filled_buffer(capacity, stamps, x, y, yaw):
+    """
+    returns a buffer holding the given poses, added in order
+    """
+    pose_buffer = PoseBuffer(capacity)
+    for pose in zip(stamps, x, y, yaw):
+        pose_buffer.add(*pose)
+    return pose_buffer
+
+
+def test_wrapped_buffer_keeps_the_newest_poses():
+    # 25 poses at 10 Hz through a buffer of 8, so that the ring wraps around three times
+    stamps = np.arange(25) / 10
+    pose_buffer = filled_buffer(8, stamps, 2 * stamps, -stamps, np.zeros(25))
+
+    assert pose_buffer.size == 8
+    assert (pose_buffer.oldest(), pose_buffer.newest()) == (stamps[17], stamps[24])
+    assert pose_buffer.lookup(stamps[16]) is None
+    assert np.allclose(pose_buffer.lookup(2.05), (4.1, -2.05, 0.0))
+
+    x, y, _, valid = pose_buffer.lookup_many([1.6, 1.75, 2.05, 2.4, 2.5])
+    assert np.array_equal(valid, [False, True, True, True, False])
+    assert np.allclose(x[valid], [3.5, 4.1, 4.8])
+    assert np.allclose(y[valid], [-1.75, -2.05, -2.4])
+
+
+def test_stale_poses_are_discarded():
+    pose_buffer = filled_buffer(4, [1.0, 2.0], [0.0, 1.0], [0.0, 0.0], [0.0, 0.0])
+    assert not pose_buffer.add(2.0, 5.0, 5.0, 0.0)
+    assert not pose_buffer.add(1.5, 5.0, 5.0, 0.0)
+    assert pose_buffer.size == 2
+    assert np.allclose(pose_buffer.lookup(1.5), (0.5, 0.0, 0.0))
+
+
+@pytest.mark.parametrize("stamp, expected", [(0.97, (0.0, 0.0, 0.0)), (3.03, (2.0, 0.0, 0.0)),
+                                             (0.9, None), (3.1, None)])
+def test_stamps_within_the_tolerance_get_the_closest_pose(stamp, expected):
+    pose_buffer = filled_buffer(4, [1.0, 2.0, 3.0], [0.0, 1.0, 2.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0])
+
+    pose = pose_buffer.lookup(stamp, tolerance=0.05)
+    x, y, yaw, valid = pose_buffer.lookup_many([stamp], tolerance=0.05)
+    if expected is None:
+        assert pose is None and not valid[0]
+    else:
+        assert np.allclose(pose, expected)
+        assert valid[0] and np.allclose((x[0], y[0], yaw[0]), expected)
+
+
+def test_empty_buffer_covers_no_stamp():
+    pose_buffer = PoseBuffer(4)
+    assert pose_buffer.lookup(0.0, tolerance=1.0) is None
+    assert not pose_buffer.lookup_many([0.0, 1.0], tolerance=1.0)[3].any()
+
+
+def test_yaw_is_interpolated_along_the_shortest_arc():
+    # turning counterclockwise from 170 deg to -170 deg crosses +-pi, not 0
+    pose_buffer = filled_buffer(4, [0.0, 1.0], [0.0, 0.0], [0.0, 0.0], np.radians([170.0, -170.0]))
+
+    yaws = [pose_buffer.lookup(stamp)[2] for stamp in (0.25, 0.5, 0.75)]
+    assert np.allclose(np.cos(yaws), np.cos(np.radians([175.0, 180.0, 185.0])))
+    assert np.allclose(np.sin(yaws), np.sin(np.radians([175.0, 180.0, 185.0])))
+    assert np.allclose(pose_buffer.lookup_many([0.25, 0.5, 0.75])[2], yaws)
+
+
+def test_deskewed_rays_follow_a_constant_velocity_motion():
+    # robot driving at 1 m/s along x while turning at 0.5 rad/s, odometry at 100 Hz
+    stamps = np.arange(101) / 100
+    pose_buffer = filled_buffer(200, stamps, stamps, np.zeros(101), 0.5 * stamps)
+
+    # 720 rays over 0.1 s, starting at 0.3 s, laser scanner 0.24 m ahead of the robot base
+    x, y, yaw = deskew_poses(pose_buffer, 0.3, 720, 0.1 / 720, 0.24)
+    ray_stamps = 0.3 + np.arange(720) * 0.1 / 720
+    assert np.allclose(yaw, 0.5 * ray_stamps)
+    assert np.allclose(x, ray_stamps + 0.24 * np.cos(yaw))
+    assert np.allclose(y, 0.24 * np.sin(yaw))
+
+
+def test_scan_beyond_the_buffered_poses_is_not_deskewed():
+    stamps = np.arange(11) / 100
+    pose_buffer = filled_buffer(20, stamps, stamps, np.zeros(11), np.zeros(11))
+
+    # the last rays are measured 0.02 s after the newest pose
+    assert deskew_poses(pose_buffer, 0.05, 100, 0.0007, 0.24, tolerance=0.01) is None
+    assert deskew_poses(pose_buffer, 0.05, 100, 0.0007, 0.24, tolerance=0.03) is not None
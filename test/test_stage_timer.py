@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""
+Tests of the rolling percentiles and the CSV trace of the mapping stages in stage_timer.py
+"""
+
+import csv
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from stage_timer import StageTimer
+
+
+def test_percentiles_cover_the_latest_values_only():
+    stage_timer = StageTimer(window=100)
+    assert stage_timer.percentiles("updatemap") is None
+
+    # the first 50 values are pushed out of the window by the next 100
+    for value in np.r_[np.full(50, 1e3), np.arange(100)]:
+        stage_timer.record("updatemap", value)
+    assert stage_timer.count("updatemap") == 150
+    assert np.allclose(stage_timer.percentiles("updatemap"), np.percentile(np.arange(100), (50, 95, 99)))
+    assert np.allclose(stage_timer.percentiles("updatemap", q=(0, 100)), (0, 99))
+
+
+def test_report_lists_the_stages_with_their_units():
+    stage_timer = StageTimer()
+    for cells in (100, 200, 300):
+        stage_timer.record("cells", cells, unit="cells")
+    stage_timer.record("updatemap", 0.002)
+
+    assert stage_timer.report() == [("cells p50/p95/p99 [cells]", "200.000 / 290.000 / 298.000"),
+                                    ("updatemap p50/p95/p99 [ms]", "2.000 / 2.000 / 2.000")]
+
+
+def test_csv_trace_holds_every_recorded_value(tmp_path):
+    csv_path = tmp_path / "stages.csv"
+    stage_timer = StageTimer(csv_path=str(csv_path))
+    with stage_timer.measure("takeMap"):
+        pass
+    stage_timer.record("cells", 42, unit="cells")
+    stage_timer.close()
+    # nothing is traced once closed
+    stage_timer.record("cells", 43, unit="cells")
+
+    # appended to by a restarted node, with a single header
+    stage_timer = StageTimer(csv_path=str(csv_path))
+    stage_timer.record("cells", 44, unit="cells")
+    stage_timer.close()
+
+    with open(csv_path) as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [(row["stage"], row["value"]) for row in rows[1:]] == [("cells", "42"), ("cells", "44")]
+    assert rows[0]["stage"] == "takeMap" and 0 <= float(rows[0]["value"]) < 1
+    assert all(float(row["time"]) > 0 for row in rows)